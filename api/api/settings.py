@@ -59,6 +59,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'core.middleware.ReplicaMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -94,6 +95,16 @@ DATABASES = {
     }
 }
 
+DATABASE_ROUTERS = ['core.routers.ReplicaRouter']
+
+# Aliases of DATABASES, that replicate the default database.
+# Safe requests to views with `use_replica = True` read from them.
+# To try it locally, add a copy of the sqlite database with {'TEST': {'MIRROR': 'default'}}.
+DATABASE_REPLICAS = []
+
+# Seconds a client reads only from the default database after it wrote something
+REPLICA_PIN_TIMEOUT = 10
+
 
 # E-Mail
 # https://docs.djangoproject.com/en/1.10/topics/email/
@@ -143,7 +154,7 @@ AUTH_PASSWORD_VALIDATORS = [
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework.authentication.TokenAuthentication',
+        'core.authentication.CachedTokenAuthentication',
         'rest_framework.authentication.SessionAuthentication',
     ),
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.LimitOffsetPagination',
@@ -151,6 +162,39 @@ REST_FRAMEWORK = {
 }
 
 
+# Background workers
+# Work, that doesn't need to be done within the request, is run by threads of the same process.
+# 0 disables them, the work is done synchronously then.
+
+BACKGROUND_WORKERS = 0
+
+# Refill the stack in the background after a post was spread (needs BACKGROUND_WORKERS)
+STACK_PREFILL = False
+
+
+# Token authentication
+# The users of tokens are cached for TOKEN_CACHE_TIMEOUT seconds in a LRU cache of each process,
+# with TOKEN_CACHE_SHARED in the default cache instead.
+# Processes only clear their own LRU cache, when a token is deleted or its user changed,
+# so with multiple processes, use TOKEN_CACHE_SHARED (and a shared cache), otherwise the others
+# accept deleted tokens for up to TOKEN_CACHE_TIMEOUT seconds.
+TOKEN_CACHE_SIZE = 1000
+TOKEN_CACHE_TIMEOUT = 60
+TOKEN_CACHE_SHARED = False
+
+
+# Bans
+# Longest time in seconds the bans of a user are cached, they are cleared whenever a ban changes
+BAN_CACHE_TIMEOUT = 60 * 60
+
+
+# Notification polling
+# Longest time in seconds a poll request waits for new notifications
+NOTIFICATION_POLL_TIMEOUT = 25
+# Comments handled by other processes are noticed after at most this many seconds
+NOTIFICATION_POLL_INTERVAL = 5
+
+
 # reCAPTCHA secret key
 # https://www.google.com/recaptcha/admin
 # https://developers.google.com/recaptcha/docs/faq
@@ -1,4 +1,26 @@
+import math
+
+
 def get_postid(post, nonce=None):
     if hasattr(post, 'pk') and hasattr(post, 'nonce'):
         return get_postid(post.pk, post.nonce)
     return "%s%s" % (nonce, post)
+
+
+def split_postid(post_id):
+    """
+    Returns (pk, nonce) of an id created by get_postid, or None if it can't be the id of a post.
+    """
+    if post_id < 10**8:
+        # The nonce has 8 digits, the pk at least 1. (And we would get a math domain error for 0)
+        return None
+
+    # We need a number that we can use to calculate the nonce and the pk from their combined value `(?<nonce>[1-9][0-9]{7})(?<pk>[1-9][0-9]*)`.
+    # To do this we need 10 to the power of the number of digits of pk.
+    operand = 10 ** (math.floor(math.log10(post_id)) + 1 - 8)  # `math.floor(math.log10(post_id)) + 1`: number of digits in post_id
+    nonce = post_id // operand
+    pk = post_id % operand
+
+    if pk <= 0:
+        return None
+    return pk, nonce
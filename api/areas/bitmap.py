@@ -0,0 +1,61 @@
+import zlib
+
+
+class Bitmap:
+    """
+    Set of non negative integers, stored as a bitmap.
+
+    The bitmap starts at offset (always a multiple of 8), so values below it don't take any space.
+    It's stored zlib compressed, which keeps sparse sets small.
+    """
+    def __init__(self, offset=0, data=b''):
+        self.offset = offset
+        self._bits = bytearray(zlib.decompress(bytes(data))) if data else bytearray()
+
+    def __contains__(self, value):
+        index = value - self.offset
+        if index < 0 or (index >> 3) >= len(self._bits):
+            return False
+        return bool(self._bits[index >> 3] & (1 << (index & 7)))
+
+    def __iter__(self):
+        for byte_index, byte in enumerate(self._bits):
+            if byte:
+                for bit in range(8):
+                    if byte & (1 << bit):
+                        yield self.offset + byte_index * 8 + bit
+
+    def __len__(self):
+        return sum(bin(byte).count('1') for byte in self._bits)
+
+    def add(self, value):
+        if not self._bits:
+            self.offset = value - value % 8
+        elif value < self.offset:
+            # Grow to the front
+            offset = value - value % 8
+            self._bits[0:0] = bytes((self.offset - offset) // 8)
+            self.offset = offset
+
+        index = value - self.offset
+        missing = (index >> 3) + 1 - len(self._bits)
+        if missing > 0:
+            self._bits.extend(bytes(missing))
+        self._bits[index >> 3] |= 1 << (index & 7)
+
+    def update(self, values):
+        # Add the smallest value first, so the bitmap doesn't have to grow to the front
+        for value in sorted(values):
+            self.add(value)
+
+    def trim(self, below):
+        """
+        Forgets (at least) all values below `below`
+        """
+        drop = min((below - self.offset) // 8, len(self._bits))
+        if drop > 0:
+            del self._bits[:drop]
+            self.offset += drop * 8
+
+    def to_bytes(self):
+        return zlib.compress(bytes(self._bits))
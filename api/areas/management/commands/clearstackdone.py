@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Min, Q
+from django.utils import timezone
+
+from ...bitmap import Bitmap
+from ...models import Post, StackSeen
+
+
+class Command(BaseCommand):
+    help = 'Can be run as a cronjob or directly to forget which expired posts users have handled.'
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+
+        # Expired posts can't get into any stack again
+        Post.stack_done.through.objects.filter(post__expires_at__lte=now).delete()
+
+        # Drafts can still be published, so they are not forgotten
+        oldest = dict(
+            Post.all_objects.filter(Q(draft=True) | Q(expires_at__gt=now)).order_by().values_list('area').annotate(Min('pk'))
+        )
+        for pk in StackSeen.objects.values_list('pk', flat=True).iterator():
+            with transaction.atomic():
+                seen = StackSeen.objects.select_for_update().get(pk=pk)
+                posts = seen.get_posts()
+                if seen.area_id in oldest:
+                    posts.trim(oldest[seen.area_id])
+                else:
+                    posts = Bitmap()  # All posts of the area expired
+                seen.set_posts(posts)
+                seen.save()
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from ...models import StackPool
+
+
+class Command(BaseCommand):
+    help = 'Can be run as a cronjob or directly to remove expired posts from the stack pool.'
+
+    def handle(self, *args, **options):
+        StackPool.objects.filter(expires_at__lte=timezone.now()).delete()
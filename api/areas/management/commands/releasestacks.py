@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from ...models import StackAssignment
+
+
+class Command(BaseCommand):
+    help = 'Can be run as a cronjob or directly to give the spread of expired stack assignments back to their posts.'
+
+    def handle(self, *args, **options):
+        released = StackAssignment.objects.release_expired()
+        self.stdout.write('Released %s assignments' % released)
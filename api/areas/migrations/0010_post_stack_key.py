@@ -0,0 +1,32 @@
+# Generated by Django 2.2.7 on 2026-10-18 17:07
+
+import areas.models
+from django.db import migrations, models
+
+
+def randomize_stack_keys(apps, schema_editor):
+    # AddField uses the same default for all existing rows, so every post needs its own key
+    Post = apps.get_model('areas', 'Post')
+
+    for post in Post.objects.all().only('pk'):
+        Post.objects.filter(pk=post.pk).update(stack_key=areas.models.Post.generate_stack_key())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('areas', '0009_remove_post_active'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='stack_key',
+            field=models.FloatField(default=areas.models.Post.generate_stack_key),
+        ),
+        migrations.RunPython(randomize_stack_keys, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['area', 'stack_key'], name='areas_post_area_id_82c438_idx'),
+        ),
+    ]
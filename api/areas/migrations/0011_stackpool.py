@@ -0,0 +1,55 @@
+# Generated by Django 2.2.7 on 2026-10-18 17:09
+
+import datetime
+
+from django.db import migrations, models
+import django.db.models.deletion
+from django.utils import timezone
+
+
+def fill_pool(apps, schema_editor):
+    Post = apps.get_model('areas', 'Post')
+    StackPool = apps.get_model('areas', 'StackPool')
+
+    StackPool.objects.bulk_create(
+        StackPool(
+            post_id=post.pk,
+            area_id=post.area_id,
+            outstanding=post.stack_outstanding,
+            expires_at=post.created + datetime.timedelta(days=30),
+            key=post.stack_key,
+        ) for post in Post.objects.filter(draft=False, created__gt=timezone.now() - datetime.timedelta(days=30)).iterator()
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('areas', '0010_post_stack_key'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StackPool',
+            fields=[
+                ('post', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stack_pool', serialize=False, to='areas.Post')),
+                ('outstanding', models.IntegerField()),
+                ('expires_at', models.DateTimeField()),
+                ('key', models.FloatField()),
+            ],
+        ),
+        migrations.RemoveIndex(
+            model_name='post',
+            name='areas_post_area_id_82c438_idx',
+        ),
+        migrations.AddField(
+            model_name='stackpool',
+            name='area',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='areas.Area'),
+        ),
+        migrations.AddIndex(
+            model_name='stackpool',
+            index=models.Index(fields=['area', 'key'], name='areas_stack_area_id_242e5b_idx'),
+        ),
+        migrations.RunPython(fill_pool, migrations.RunPython.noop),
+    ]
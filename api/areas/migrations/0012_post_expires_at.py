@@ -0,0 +1,32 @@
+# Generated by Django 2.2.7 on 2026-10-18 17:10
+
+import datetime
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def set_expires_at(apps, schema_editor):
+    Post = apps.get_model('areas', 'Post')
+
+    Post.objects.filter(draft=False).update(expires_at=F('created') + datetime.timedelta(days=30))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('areas', '0011_stackpool'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='expires_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(set_expires_at, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(condition=models.Q(stack_outstanding__gt=0), fields=['area', 'expires_at'], name='areas_post_area_expires_idx'),
+        ),
+    ]
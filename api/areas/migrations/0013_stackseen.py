@@ -0,0 +1,29 @@
+# Generated by Django 2.2.7 on 2026-10-18 17:11
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('areas', '0012_post_expires_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StackSeen',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('offset', models.IntegerField(default=0)),
+                ('bitmap', models.BinaryField(default=b'')),
+                ('area', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='areas.Area')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('user', 'area')},
+            },
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 2.2.7 on 2026-10-18 17:20
+
+import areas.models
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('areas', '0013_stackseen'),
+    ]
+
+    operations = [
+        # The through model uses the table of the automatically created model, so only the state changes
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name='StackAssignment',
+                    fields=[
+                        ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                        ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='areas.Post')),
+                        ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+                    ],
+                    options={
+                        'db_table': 'areas_post_stack_assigned',
+                        'unique_together': {('post', 'user')},
+                    },
+                ),
+                migrations.AlterField(
+                    model_name='post',
+                    name='stack_assigned',
+                    field=models.ManyToManyField(related_name='post_assigned', through='areas.StackAssignment', to=settings.AUTH_USER_MODEL),
+                ),
+            ],
+        ),
+        migrations.AddField(
+            model_name='stackassignment',
+            name='leased_until',
+            field=models.DateTimeField(db_index=True, default=areas.models.StackAssignment.generate_lease_end),
+        ),
+    ]
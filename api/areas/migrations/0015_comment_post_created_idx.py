@@ -0,0 +1,17 @@
+# Generated by Django 2.2.7 on 2026-10-18 17:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('areas', '0014_stackassignment'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['post', 'created', 'id'], name='areas_comment_post_created_idx'),
+        ),
+    ]
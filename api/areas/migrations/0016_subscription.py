@@ -0,0 +1,66 @@
+# Generated by Django 2.2.7 on 2026-10-18 17:20
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Min, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+import django.db.models.deletion
+
+
+def convert_unread(apps, schema_editor):
+    """
+    Sets last_seen to the newest comment of the post, or before the first unread comment
+    """
+    Comment = apps.get_model('areas', 'Comment')
+    Subscription = apps.get_model('areas', 'Subscription')
+    Unread = Comment.unread.through
+
+    Subscription.objects.update(last_seen=Coalesce(Subquery(
+        Comment.objects.filter(post=OuterRef('post')).order_by('-pk').values('pk')[:1]), 0))
+
+    first_unread = Unread.objects.values('user', 'comment__post').annotate(first=Min('comment')).order_by()
+    for entry in first_unread.iterator():
+        Subscription.objects.filter(user=entry['user'], post=entry['comment__post']).update(last_seen=entry['first'] - 1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('areas', '0015_comment_post_created_idx'),
+    ]
+
+    operations = [
+        # The through model uses the table of the automatically created model, so only the state changes
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name='Subscription',
+                    fields=[
+                        ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                        ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='areas.Post')),
+                        ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+                    ],
+                    options={
+                        'db_table': 'areas_post_subscriber',
+                        'unique_together': {('post', 'user')},
+                    },
+                ),
+                migrations.AlterField(
+                    model_name='post',
+                    name='subscriber',
+                    field=models.ManyToManyField(blank=True, related_name='post_subscriber', through='areas.Subscription', to=settings.AUTH_USER_MODEL),
+                ),
+            ],
+        ),
+        migrations.AddField(
+            model_name='subscription',
+            name='last_seen',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(convert_unread, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='comment',
+            name='unread',
+        ),
+    ]
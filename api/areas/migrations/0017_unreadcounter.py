@@ -0,0 +1,24 @@
+# Generated by Django 2.2.7 on 2026-10-18 17:24
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_auto_20190407_2013'),
+        ('areas', '0016_subscription'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UnreadCounter',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='unread_counter', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('comments', models.IntegerField(default=0)),
+                ('posts', models.IntegerField(default=0)),
+            ],
+        ),
+    ]
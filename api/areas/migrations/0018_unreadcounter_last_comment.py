@@ -0,0 +1,18 @@
+# Generated by Django 2.2.7 on 2026-10-18 17:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('areas', '0017_unreadcounter'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='unreadcounter',
+            name='last_comment',
+            field=models.IntegerField(default=0),
+        ),
+    ]
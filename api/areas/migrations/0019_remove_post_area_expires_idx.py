@@ -0,0 +1,17 @@
+# Generated by Django 2.2.7 on 2026-10-18 17:49
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('areas', '0018_unreadcounter_last_comment'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='post',
+            name='areas_post_area_expires_idx',
+        ),
+    ]
@@ -1,18 +1,88 @@
 import datetime
 import os
 import uuid
-from random import randint, sample
+from collections import Counter, defaultdict
+from random import randint, random
 
 from django.conf import settings
-from django.db import models
-from django.db.models import Case, F, Q, When
+from django.contrib.auth import get_user_model
+from django.db import IntegrityError, connection, models, transaction
+from django.db.models import Case, Count, Exists, F, Max, Min, OuterRef, Prefetch, Q, Subquery, Value, When
+from django.db.models.functions import Coalesce, Greatest
+from django.db.models.signals import pre_delete
+from django.dispatch import receiver
 from django.utils import timezone
 
+from bans.models import Ban
+from core import pubsub
+from users.models import Profile
+
+from .bitmap import Bitmap
+
 
 def image_path(instance, filename):
     return 'images/%u%s' % (uuid.uuid4(), os.path.splitext(filename)[1])
 
 
+def get_profile(user):
+    """
+    Returns the profile of the user, also when it was loaded with select_related and doesn't exist yet
+    """
+    try:
+        return user.profile
+    except Profile.DoesNotExist:
+        # Profile.objects.get creates the missing profile
+        return Profile.objects.get(user=user)
+
+
+def random_sample(queryset, key, count, skip=None, max_batches=None):
+    """
+    Returns up to count random objects of the queryset.
+
+    Every object needs a random value between 0 and 1 in the (indexed) field key.
+    A random pivot is chosen and the objects following it are taken, wrapping around to the start if necessary.
+    So only the returned rows are read from the database instead of the whole queryset.
+
+    Objects for which skip(obj) returns True are not returned. They are read in batches until enough were found,
+    but at most max_batches batches, so fewer objects might be returned when most are skipped.
+    """
+    pivot = random()
+    batch_size = count if skip is None else count * 2
+
+    result = []
+    batches = 0
+    for part in (queryset.filter(**{key + '__gte': pivot}), queryset.filter(**{key + '__lt': pivot})):
+        last = None
+        while len(result) < count:
+            if max_batches is not None and batches >= max_batches:
+                return result
+            batches += 1
+
+            batch = part if last is None else part.filter(**{key + '__gt': last})
+            batch = list(batch.order_by(key)[:batch_size])
+
+            result += [obj for obj in batch if skip is None or not skip(obj)][:count - len(result)]
+            if len(batch) < batch_size:
+                break  # Nothing left in this part
+            last = getattr(batch[-1], key)
+    return result
+
+
+def get_author_queryset():
+    """
+    Users with their profile and the banned annotation, as needed to serialize them as author
+    """
+    return get_user_model().objects.select_related('profile').annotate(
+        banned=Exists(Ban.active.filter(user=OuterRef('pk'))))
+
+
+class StackConflict(Exception):
+    """
+    Raised when posts could not be assigned, because a concurrent request claimed them first
+    """
+    pass
+
+
 class Area(models.Model):
     name = models.CharField(max_length=30, unique=True, db_index=True)
     displayname = models.CharField(max_length=30, unique=True)
@@ -21,12 +91,43 @@ class Area(models.Model):
         return self.name
 
 
-class PostAllManager(models.Manager):
+class PostQuerySet(models.QuerySet):
+    def with_header(self, user):
+        """
+        Loads the author and annotates subscribed, as needed by the PostHeaderSerializer
+        """
+        if user.is_authenticated:
+            subscribed = Exists(Post.subscriber.through.objects.filter(post=OuterRef('pk'), user=user.pk))
+        else:
+            subscribed = Value(False, output_field=models.BooleanField())
+        return self.prefetch_related(Prefetch('author', queryset=get_author_queryset())).annotate(subscribed=subscribed)
+
+    def with_details(self, user, comment_limit=None):
+        """
+        Loads everything the PostSerializer needs for user with a fixed number of queries, no matter how many posts there are.
+        Annotates subscribed to the posts and banned to the authors.
+
+        With comment_limit only the newest comment_limit + 1 comments of every post are loaded,
+        the extra one tells whether there are older comments.
+        """
+        comments = Comment.objects.prefetch_related(
+            Prefetch('author', queryset=get_author_queryset())).order_by('created', 'pk')
+        if comment_limit is not None:
+            newest = Comment.objects.filter(post=OuterRef('post')).order_by('-created', '-pk').values('pk')
+            comments = comments.filter(pk__in=Subquery(newest[:comment_limit + 1]))
+
+        return self.with_header(user).prefetch_related(
+            'additional_images',
+            Prefetch('comment_set', queryset=comments),
+        )
+
+
+class PostAllManager(models.Manager.from_queryset(PostQuerySet)):
     @staticmethod
     def get_active_annotation():
         return Case(
                 When(draft=True, then=False),
-                When(Q(created__lt=timezone.now() - datetime.timedelta(days=30)), then=False),
+                When(Q(expires_at__lte=timezone.now()), then=False),
                 default=True,
                 output_field=models.BooleanField(),
             )
@@ -46,27 +147,36 @@ class Post(models.Model):
         # Will never start with 0
         return randint(10**7, 10**8-1)
 
+    def generate_stack_key():
+        # Random number in [0, 1) used to pick random posts for the stack
+        return random()
+
     area = models.ForeignKey(Area, on_delete=models.CASCADE)
     author = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=False)  # Might be null, but must only when user gets deleted
     anonym = models.BooleanField(default=False)
     nonce = models.IntegerField(default=generate_nonce)  # To prevent malicious users from trying pk's
     created = models.DateTimeField(default=timezone.now)
+    expires_at = models.DateTimeField(null=True, blank=True)  # Null for drafts
     draft = models.BooleanField(default=False, db_index=True)
     text = models.TextField()
     image = models.ImageField(upload_to=image_path, null=True, blank=True, default=None)
 
     # Post stack
     stack_outstanding = models.IntegerField(default=0)
-    stack_assigned = models.ManyToManyField(settings.AUTH_USER_MODEL, db_index=True, related_name='%(class)s_assigned')
+    stack_key = models.FloatField(default=generate_stack_key)  # Used to pick random posts through the index of StackPool
+    stack_assigned = models.ManyToManyField(settings.AUTH_USER_MODEL, through='StackAssignment', related_name='%(class)s_assigned')
     stack_done = models.ManyToManyField(settings.AUTH_USER_MODEL, db_index=True, related_name='%(class)s_done')
 
-    subscriber = models.ManyToManyField(settings.AUTH_USER_MODEL, blank=True, related_name='%(class)s_subscriber')
+    subscriber = models.ManyToManyField(settings.AUTH_USER_MODEL, through='Subscription', blank=True, related_name='%(class)s_subscriber')
 
     objects = PostManager()
     all_objects = PostAllManager()
 
     active = None  # Required, so that the serializer finds this field. Will be set through the annotation.
 
+    LIFETIME = datetime.timedelta(days=30)  # Posts are active for this long after being published
+    MAX_USER_STACK = 10  # Number of posts in the stack of a user
+
     class Meta:
         ordering = ['pk']
 
@@ -78,14 +188,20 @@ class Post(models.Model):
 
         if new and not self.draft:
             self.activate()
+        if not self.draft:
+            self.expires_at = self.created + self.LIFETIME  # Keep in line, when created was changed
         super().save(force_insert, force_update, using, update_fields)
         if new:
             self.stack_done.add(self.author)
+            StackSeen.mark(self.author, self.area, [self.pk])
             self.subscriber.add(self.author)
+        if not self.draft:
+            StackPool.sync(self)
 
     def activate(self):
         self.draft = False
         self.created = timezone.now()
+        self.expires_at = self.created + self.LIFETIME
         self.stack_outstanding = self.get_spread(self.area, self.author)
         self.active = True  # Post should be active now, so set active to true
 
@@ -101,7 +217,7 @@ class Post(models.Model):
         """
         if self.anonym or self.author is None:
             return None
-        return self.author.profile
+        return get_profile(self.author)
 
     def publish(self):
         if not self.draft:
@@ -114,33 +230,104 @@ class Post(models.Model):
         """
         Fills up the stack of the user and returns it
         """
-        MAX_USER_STACK = 10
+        MAX_FILL_ATTEMPTS = 3
+        MAX_SAMPLE_BATCHES = 5  # Users who handled most posts get a partial stack instead of scanning the whole pool
 
         stack = cls.objects.filter(area=area, stack_assigned__pk=user.pk)
 
-        missing = MAX_USER_STACK - stack.count()
-        if missing > 0:
-            available = cls.objects.filter(active=True, area=area, stack_outstanding__gt=0)
-            available = available.exclude(pk__in=stack.values('pk'))  # Exclude allready assined
-            available = available.exclude(pk__in=cls.objects.filter(stack_done__pk=user.pk))  # Exclude already done
-
-            numAvailable = len(available)  # Evaluate queryset. To avoid race conditions (less available than count)
-            if numAvailable <= missing:
-                # When there are not more cards available than missing take all
-                for post in available:
-                    post.assign_user(user)
-            else:
-                for index in sample(range(numAvailable), missing):
-                    available[index].assign_user(user)
+        for _ in range(MAX_FILL_ATTEMPTS):
+            try:
+                with transaction.atomic():
+                    leases = StackAssignment.objects.filter(user_id=user.pk, post__area=area).aggregate(
+                        count=Count('pk'), earliest=Min('leased_until'))
+                    if leases['earliest'] is not None and leases['earliest'] < StackAssignment.objects.get_renew_threshold():
+                        # Only write, when a lease needs to be renewed
+                        StackAssignment.objects.renew(area, user)
+
+                    missing = cls.MAX_USER_STACK - leases['count']
+                    if missing > 0:
+                        available = StackPool.objects.available(area, user)
+                        seen = StackSeen.get(user, area).get_posts()
+
+                        entries = random_sample(
+                            available, 'key', missing, skip=lambda entry: entry.pk in seen,  # Exclude already done
+                            max_batches=MAX_SAMPLE_BATCHES)
+                        pks = [entry.pk for entry in entries]
+
+                        if pks and connection.features.has_select_for_update_skip_locked:
+                            # Lock only the picked posts, posts locked by concurrent fills are left to them instead of waited for
+                            pks = list(StackPool.objects.select_for_update(skip_locked=True).filter(
+                                pk__in=pks).values_list('pk', flat=True))
+
+                        cls.assign_posts(pks, user)
+                break
+            except StackConflict:
+                # Someone else took the last spread of a post. Try again with fresh data.
+                continue
 
         return stack
 
+    @classmethod
+    def assign_posts(cls, pks, user):
+        """
+        Adds all posts to the stack of the user.
+        Uses one insert into the stack and one update of stack_outstanding, no matter how many posts are assigned.
+
+        stack_outstanding is only decremented when it is still positive.
+        If any post has no outstanding spread left or is already assigned to the user,
+        nothing is assigned and StackConflict is raised.
+        """
+        if not pks:
+            return
+
+        leased_until = StackAssignment.generate_lease_end()
+        try:
+            with transaction.atomic():
+                claimed = cls.all_objects.filter(pk__in=pks, stack_outstanding__gt=0).update(
+                    stack_outstanding=F('stack_outstanding') - 1)
+                if claimed != len(pks):
+                    raise StackConflict()
+                StackPool.objects.filter(pk__in=pks).update(outstanding=F('outstanding') - 1)
+
+                StackAssignment.objects.bulk_create([
+                    StackAssignment(post_id=pk, user_id=user.pk, leased_until=leased_until) for pk in pks
+                ])
+        except IntegrityError:
+            raise StackConflict()
+
     def assign_user(self, user):
-        self.stack_outstanding = F('stack_outstanding') - 1
-        self.stack_assigned.add(user)
-        self.save()
+        self.assign_posts([self.pk], user)
         self.refresh_from_db()
 
+    @classmethod
+    def add_outstanding(cls, pks, amount):
+        """
+        Adds amount to stack_outstanding of the posts, without overwriting concurrent changes
+        """
+        with transaction.atomic():
+            cls.all_objects.filter(pk__in=pks).update(stack_outstanding=F('stack_outstanding') + amount)
+            StackPool.objects.filter(pk__in=pks).update(outstanding=F('outstanding') + amount)
+
+    @classmethod
+    def remove_from_stack(cls, area, user, spread=(), skipped=()):
+        """
+        Removes the posts from the stack of the user and marks them done.
+        The posts in spread are spread with the spread of the user, the posts in skipped are not.
+        Needs the same number of queries, no matter how many posts are removed.
+        """
+        pks = list(spread) + list(skipped)
+        if not pks:
+            return
+
+        Done = cls.stack_done.through
+        with transaction.atomic():
+            if spread:
+                cls.add_outstanding(spread, cls.get_spread(area, user))
+
+            Done.objects.bulk_create([Done(post_id=pk, user_id=user.pk) for pk in pks], ignore_conflicts=True)
+            StackSeen.mark(user, area, pks)
+            StackAssignment.objects.filter(user_id=user.pk, post_id__in=pks).delete()
+
     @staticmethod
     def get_spread(area, user):
         return Reputation.get_spread(area, user).spread
@@ -149,6 +336,345 @@ class Post(models.Model):
     get_uri_key.short_description = 'id'
 
 
+class StackAssignmentManager(models.Manager):
+    def get_renew_threshold(self):
+        """
+        Leases ending before this are renewed, when at least half of the lease time is over
+        """
+        return timezone.now() + StackAssignment.LEASE / 2
+
+    def renew(self, area, user):
+        """
+        Extends the leases of the stack of the user, which end before the renew threshold
+        """
+        return self.get_queryset().filter(
+            user=user, post__area=area, leased_until__lt=self.get_renew_threshold()
+        ).update(leased_until=StackAssignment.generate_lease_end())
+
+    def release_expired(self, batch_size=500):
+        """
+        Removes all assignments with an expired lease from the stacks and gives the spread back to their posts.
+        Returns the number of released assignments.
+        """
+        released = 0
+        now = timezone.now()
+        while True:
+            with transaction.atomic():
+                expired = list(self.get_queryset().select_for_update().filter(
+                    leased_until__lte=now).values_list('pk', 'post_id')[:batch_size])
+                if not expired:
+                    return released
+
+                # One update for all posts that got the same number of assignments released
+                posts = defaultdict(list)
+                for post, count in Counter(post for _, post in expired).items():
+                    posts[count].append(post)
+                for count, pks in posts.items():
+                    Post.add_outstanding(pks, count)
+
+                self.get_queryset().filter(pk__in=[pk for pk, _ in expired]).delete()
+                released += len(expired)
+
+
+class StackAssignment(models.Model):
+    """
+    A post in the stack of a user.
+    The assignment holds one of the outstanding spreads of the post until it's lease ends.
+    """
+    def generate_lease_end():
+        return timezone.now() + StackAssignment.LEASE
+
+    post = models.ForeignKey(Post, on_delete=models.CASCADE)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    leased_until = models.DateTimeField(default=generate_lease_end, db_index=True)
+
+    objects = StackAssignmentManager()
+
+    LEASE = datetime.timedelta(days=7)
+
+    class Meta:
+        db_table = 'areas_post_stack_assigned'  # Was the automatically created table before
+        unique_together = (('post', 'user'),)
+
+    def __str__(self):
+        return '%s: %s' % (self.user, self.post)
+
+
+class SubscriptionQuerySet(models.QuerySet):
+    def mark_read(self):
+        """
+        Marks all comments of the subscribed posts read with one update
+        """
+        return self.update(last_seen=Subscription.latest_comment(OuterRef('post')))
+
+
+class Subscription(models.Model):
+    """
+    A user subscribed to a post.
+    All comments up to last_seen are read, newer ones (not written by the user) are unread.
+    """
+    post = models.ForeignKey(Post, on_delete=models.CASCADE)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    last_seen = models.IntegerField(default=0)  # Primary key of the newest read comment
+
+    objects = models.Manager.from_queryset(SubscriptionQuerySet)()
+
+    class Meta:
+        db_table = 'areas_post_subscriber'  # Was the automatically created table before
+        unique_together = (('post', 'user'),)
+
+    def __str__(self):
+        return '%s: %s' % (self.user, self.post)
+
+    @staticmethod
+    def latest_comment(post):
+        """
+        Expression for the primary key of the newest comment of post (may be an OuterRef) or 0
+        """
+        return Coalesce(Subquery(Comment.objects.filter(post=post).order_by('-pk').values('pk')[:1]), 0)
+
+    @staticmethod
+    def subscribe(post, user):
+        """
+        Subscribes user to post, the existing comments are read
+        """
+        post.subscriber.add(user, through_defaults={
+            'last_seen': post.comment_set.order_by('-pk').values_list('pk', flat=True).first() or 0})
+
+    @staticmethod
+    def unread_comments(user):
+        """
+        The unread comments of all posts user subscribed to
+        """
+        return Comment.objects.filter(
+            post__subscription__user=user, pk__gt=F('post__subscription__last_seen')
+        ).exclude(author=user)
+
+    @staticmethod
+    def mark_post_read(post, user):
+        """
+        Marks the comments of post read for user and updates the unread counter.
+        Nothing is written, if there are no unread comments.
+        """
+        unread = Subscription.unread_comments(user).filter(post=post).aggregate(count=Count('pk'), latest=Max('pk'))
+        if not unread['count']:
+            return
+
+        with transaction.atomic():
+            # Only the request which actually moved last_seen updates the counter
+            if Subscription.objects.filter(post=post, user=user, last_seen__lt=unread['latest']).update(last_seen=unread['latest']):
+                UnreadCounter.objects.filter(pk=user.pk).update(
+                    comments=Greatest(F('comments') - unread['count'], 0), posts=Greatest(F('posts') - 1, 0))
+
+
+class UnreadCounter(models.Model):
+    """
+    Number of unread comments and of posts with unread comments of a user.
+
+    Updated when comments are created, read or deleted. A missing counter is counted from the subscriptions,
+    so counters only exist for users which asked for them.
+    """
+    user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, primary_key=True, related_name='unread_counter')
+    comments = models.IntegerField(default=0)
+    posts = models.IntegerField(default=0)
+    last_comment = models.IntegerField(default=0)  # Newest comment when the counter was counted, older ones are not added again
+
+    CHANNEL = 'unread'
+
+    def __str__(self):
+        return '%s: %s' % (self.user, self.comments)
+
+    @classmethod
+    def get(cls, user):
+        counter = cls.objects.filter(pk=user.pk).first()
+        if counter is None:
+            # Comments after the newest one are added by add_comment
+            last_comment = Comment.objects.order_by('-pk').values_list('pk', flat=True).first() or 0
+            unread = Subscription.unread_comments(user).filter(pk__lte=last_comment)
+            counter, _ = cls.objects.get_or_create(user=user, defaults={
+                'comments': unread.count(), 'posts': unread.values('post').distinct().count(), 'last_comment': last_comment})
+        return counter
+
+    @classmethod
+    def add_comment(cls, comment):
+        """
+        Counts comment as unread for the subscribers of its post, except its author, with two updates
+        """
+        subscriptions = Subscription.objects.filter(post=comment.post_id, last_seen__lt=comment.pk).exclude(user=comment.author_id)
+        earlier_unread = Comment.objects.filter(
+            post=OuterRef('post'), pk__gt=OuterRef('last_seen'), pk__lt=comment.pk).exclude(author=OuterRef('user'))
+        first_unread = subscriptions.annotate(earlier_unread=Exists(earlier_unread)).filter(earlier_unread=False)
+        # Counters counted after the comment was created already contain it
+        counters = cls.objects.filter(last_comment__lt=comment.pk)
+
+        with transaction.atomic():
+            counters.filter(pk__in=first_unread.values('user')).update(posts=F('posts') + 1)
+            counters.filter(pk__in=subscriptions.values('user')).update(comments=F('comments') + 1)
+
+            # Wake up the subscribers waiting for notifications in this process
+            waiting = [pk for name, pk in pubsub.broker.channels() if name == cls.CHANNEL]
+            if waiting:
+                users = list(subscriptions.filter(user__in=waiting).values_list('user', flat=True))
+
+                def notify():
+                    for user in users:
+                        pubsub.broker.publish(cls.get_channel(user), comment.pk)
+                transaction.on_commit(notify)
+
+    @classmethod
+    def remove_comment(cls, comment):
+        """
+        Removes the deleted comment from the counters of the subscribers, which didn't read it yet, with two updates.
+        Comments deleted with their post are removed by remove_post instead.
+        """
+        subscriptions = Subscription.objects.filter(post=comment.post_id, last_seen__lt=comment.pk).exclude(user=comment.author_id)
+        other_unread = Comment.objects.filter(
+            post=OuterRef('post'), pk__gt=OuterRef('last_seen')).exclude(pk=comment.pk).exclude(author=OuterRef('user'))
+        last_unread = subscriptions.annotate(other_unread=Exists(other_unread)).filter(other_unread=False)
+
+        with transaction.atomic():
+            cls.objects.filter(pk__in=last_unread.values('user')).update(posts=Greatest(F('posts') - 1, 0))
+            cls.objects.filter(pk__in=subscriptions.values('user')).update(comments=Greatest(F('comments') - 1, 0))
+
+    @classmethod
+    def remove_post(cls, post):
+        """
+        Removes the unread comments of the deleted post from the counters of its subscribers.
+        Needs to run before the subscriptions are deleted with the post.
+        """
+        unread = Comment.objects.filter(
+            post=OuterRef('post'), pk__gt=OuterRef('last_seen')).exclude(author=OuterRef('user')).order_by().values(
+            'post').annotate(count=Count('pk')).values('count')
+        subscriptions = Subscription.objects.filter(post=post)
+
+        # One update for all users with the same number of unread comments
+        users = defaultdict(list)
+        for user, count in subscriptions.annotate(unread=Subquery(unread, output_field=models.IntegerField())).filter(unread__gt=0).values_list('user', 'unread'):
+            users[count].append(user)
+
+        with transaction.atomic():
+            for count, pks in users.items():
+                cls.objects.filter(pk__in=pks).update(
+                    comments=Greatest(F('comments') - count, 0), posts=Greatest(F('posts') - 1, 0))
+            # So the comments deleted with the post are not removed again
+            subscriptions.mark_read()
+
+    @classmethod
+    def get_channel(cls, user_pk):
+        """
+        Channel of the broker on which users are notified about new comments
+        """
+        return (cls.CHANNEL, user_pk)
+
+
+class StackPoolManager(models.Manager):
+    def available(self, area, user):
+        """
+        Returns the entries, that can be assigned to the stack of the user.
+        Posts the user already handled are not excluded, use StackSeen for them.
+        """
+        return self.get_queryset().filter(area=area, outstanding__gt=0, expires_at__gt=timezone.now()).exclude(
+            pk__in=StackAssignment.objects.filter(user_id=user.pk).values('post_id')  # Exclude already assigned
+        )
+
+
+class StackPool(models.Model):
+    """
+    Published posts, that can be assigned to stacks.
+    Mirrors the stack fields of the post, so the stack can be filled without scanning all posts.
+    """
+    post = models.OneToOneField(Post, on_delete=models.CASCADE, primary_key=True, related_name='stack_pool')
+    area = models.ForeignKey(Area, on_delete=models.CASCADE)
+    outstanding = models.IntegerField()
+    expires_at = models.DateTimeField()
+    key = models.FloatField()
+
+    objects = StackPoolManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['area', 'key']),
+        ]
+
+    def __str__(self):
+        return "%s (%s)" % (self.post_id, self.outstanding)
+
+    @classmethod
+    def sync(cls, post):
+        """
+        Creates or updates the entry of a (published) post
+        """
+        if not isinstance(post.stack_outstanding, int):
+            # stack_outstanding is an expression that was just saved
+            post.refresh_from_db(fields=['stack_outstanding'])
+
+        cls.objects.update_or_create(post=post, defaults={
+            'area_id': post.area_id,
+            'outstanding': post.stack_outstanding,
+            'expires_at': post.expires_at,
+            'key': post.stack_key,
+        })
+
+
+class StackSeen(models.Model):
+    """
+    All posts of an area a user has handled or authored, as a compact bitmap.
+    Contains the same posts as stack_done, but is much cheaper to check when filling the stack.
+    """
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    area = models.ForeignKey(Area, on_delete=models.CASCADE)
+    offset = models.IntegerField(default=0)
+    bitmap = models.BinaryField(default=b'')
+
+    class Meta:
+        unique_together = (('user', 'area'),)
+
+    def __str__(self):
+        return '%s/%s' % (self.area, self.user)
+
+    def get_posts(self):
+        return Bitmap(self.offset, self.bitmap)
+
+    def set_posts(self, posts):
+        self.offset = posts.offset
+        self.bitmap = posts.to_bytes()
+
+    @classmethod
+    def get(cls, user, area, for_update=False):
+        """
+        Returns the object of the user. If it doesn't exist it is created from stack_done
+        """
+        queryset = cls.objects.select_for_update() if for_update else cls.objects.all()
+        try:
+            return queryset.get(user=user, area=area)
+        except cls.DoesNotExist:
+            Done = Post.stack_done.through
+
+            posts = Bitmap()
+            posts.update(Done.objects.filter(user_id=user.pk, post__area=area).values_list('post_id', flat=True))
+            seen = cls(user=user, area=area)
+            seen.set_posts(posts)
+            try:
+                with transaction.atomic():
+                    seen.save()
+                return seen
+            except IntegrityError:
+                # Someone creating the same object was faster
+                return queryset.get(user=user, area=area)
+
+    @classmethod
+    def mark(cls, user, area, pks):
+        """
+        Adds the posts to the handled posts of the user
+        """
+        with transaction.atomic():
+            seen = cls.get(user, area, for_update=True)
+            posts = seen.get_posts()
+            posts.update(pks)
+            seen.set_posts(posts)
+            seen.save()
+
+
 class PostImage(models.Model):
     post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='additional_images')
     num = models.IntegerField()
@@ -172,22 +698,43 @@ class Comment(models.Model):
     text = models.TextField()
     image = models.ImageField(upload_to=image_path, null=True, blank=True, default=None)
 
-    unread = models.ManyToManyField(settings.AUTH_USER_MODEL, blank=True, related_name='%(class)s_unread')
-
     class Meta:
         ordering = ['created']
+        indexes = [
+            # Comments of a post in the order they are paginated
+            models.Index(fields=['post', 'created', 'id'], name='areas_comment_post_created_idx'),
+        ]
 
     def save(self, force_insert=False, force_update=False, using=None, update_fields=None):
         new = self.pk is None
-        super().save(force_insert, force_update, using, update_fields)
-        if new:
-            self.post.subscriber.add(self.author.pk)  # Ensure comment author is subscribed
-            subscriber = self.post.subscriber.exclude(pk=self.author.pk)
-            self.unread.add(*subscriber)
+        with transaction.atomic():
+            super().save(force_insert, force_update, using, update_fields)
+            if new:
+                # Ensure comment author is subscribed, with a single insert no matter if they already are.
+                # Other subscribers see the comment as unread through their last_seen, so there is nothing to fan out.
+                Subscription.objects.bulk_create(
+                    [Subscription(post_id=self.post_id, user_id=self.author_id, last_seen=self.pk)], ignore_conflicts=True)
+
+                # Counted with the comment, so no increment is lost or races with reading the post.
+                # Two updates, no matter how many subscribers there are.
+                UnreadCounter.add_comment(self)
 
     def __str__(self):
         return "%s/%s" % (self.post, self.pk)
 
+    def get_profile(self):
+        """
+        Returns the profile of the author or None if the author got deleted
+        """
+        if self.author is None:
+            return None
+        return get_profile(self.author)
+
+
+@receiver(pre_delete, sender=Post)
+def remove_unread_post(sender, instance, **kwargs):
+    UnreadCounter.remove_post(instance)
+
 
 class Reputation(models.Model):
     area = models.ForeignKey(Area, on_delete=models.CASCADE)
@@ -0,0 +1,27 @@
+from core.pagination import KeysetPagination
+
+
+class CommentPagination(KeysetPagination):
+    """
+    Pages through the comments of a post, oldest first
+    """
+    ordering = ('created', 'id')
+    embed_query_param = 'comments'
+
+    @classmethod
+    def get_embed_limit(cls, request):
+        """
+        Number of newest comments to embed in posts (`?comments=<n>`) or None to embed all
+        """
+        try:
+            limit = int(request.query_params[cls.embed_query_param])
+        except (KeyError, ValueError):
+            return None
+        return max(0, min(limit, cls.max_page_size))
+
+
+class NotificationPagination(KeysetPagination):
+    """
+    Pages through the posts with unread comments, most recent activity first
+    """
+    ordering = ('-activity', '-post')
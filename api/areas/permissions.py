@@ -30,6 +30,8 @@ class IsInStack(permissions.BasePermission):
     """
     Only allow access if the card is in the users stack
     """
+    message = 'The post is not in your stack.'
+
     def has_object_permission(self, request, view, obj):
         if (obj.__class__ == type):
             # Anonymous object for this user
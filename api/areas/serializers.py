@@ -3,7 +3,8 @@ from rest_framework import serializers
 from core.validators import FileSizeValidator
 from users.serializers import ProfileSerializer
 
-from .models import Area, Comment, Post, PostImage, Reputation
+from .models import Area, Comment, Post, PostImage, Reputation, UnreadCounter
+from .pagination import CommentPagination
 
 
 class AreaSerializer(serializers.ModelSerializer):
@@ -28,7 +29,7 @@ class PostImageSerializer(serializers.ModelSerializer):
 
 
 class CommentSerializer(serializers.ModelSerializer):
-    author = ProfileSerializer(read_only=True, source='author.profile')
+    author = ProfileSerializer(read_only=True, source='get_profile')
     image = serializers.ImageField(allow_null=True, max_length=100, required=False, validators=[FileSizeValidator(0.5)])
 
     class Meta:
@@ -53,14 +54,46 @@ class PostSerializer(MinimalPostSerializer):
     comments = CommentSerializer(many=True, read_only=True, source='comment_set')
 
     def get_subscribed(self, obj):
+        if hasattr(obj, 'subscribed'):
+            # Annotated by Post.objects.with_details()
+            return obj.subscribed
+
         user = self.context['request'].user
         return obj.subscriber.filter(pk=user.pk).exists()
 
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+
+        request = self.context.get('request')
+        limit = CommentPagination.get_embed_limit(request) if request is not None else None
+        if limit is not None:
+            # Only embed the newest comments, older ones can be paged through with the cursor
+            comments = list(instance.comment_set.all())
+            embedded = comments[-limit:] if limit else []
+            data['comments'] = CommentSerializer(embedded, many=True, context=self.context).data
+
+            cursor = None
+            if len(comments) > limit:
+                cursor = CommentPagination().encode_cursor(embedded[0] if embedded else None, reverse=True)
+            data['comments_cursor'] = cursor
+        return data
+
     class Meta(MinimalPostSerializer.Meta):
         fields = ('id', 'author', 'anonym', 'subscribed', 'created', 'active', 'text', 'image', 'additional_images', 'comments',)
         read_only_fields = ('created', 'active', 'subscribed')
 
 
+class PostHeaderSerializer(MinimalPostSerializer):
+    """
+    Post without its text, images and comments, for clients which already have them
+    """
+    subscribed = serializers.BooleanField(read_only=True)
+
+    class Meta(MinimalPostSerializer.Meta):
+        fields = ('id', 'author', 'anonym', 'subscribed', 'created', 'active',)
+        read_only_fields = ('anonym', 'created', 'active',)
+
+
 class MinimalPostAreaSerializer(MinimalPostSerializer):
     area = serializers.ReadOnlyField(source='area.name')
 
@@ -75,6 +108,12 @@ class NotificationSerializer(serializers.Serializer):
     comments = serializers.ListField(child=serializers.IntegerField())
 
 
+class NotificationCountSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = UnreadCounter
+        fields = ('comments', 'posts',)
+
+
 class SpreadSerializer(serializers.Serializer):
     spread = serializers.BooleanField()
 
@@ -82,6 +121,23 @@ class SpreadSerializer(serializers.Serializer):
         return type("", (), dict(spread=validated_data.get('spread')))
 
 
+class PostSpreadSerializer(SpreadSerializer):
+    id = serializers.IntegerField()
+
+
+class BatchSpreadSerializer(serializers.Serializer):
+    posts = PostSpreadSerializer(many=True, allow_empty=False)
+
+    def validate_posts(self, value):
+        # More posts can't be in the stack anyway
+        if len(value) > Post.MAX_USER_STACK:
+            raise serializers.ValidationError("Ensure this field has no more than %s elements." % Post.MAX_USER_STACK)
+        return value
+
+    def create(self, validated_data):
+        return type("", (), dict(posts=validated_data.get('posts')))
+
+
 class SubscribeSerializer(serializers.Serializer):
     subscribed = serializers.BooleanField()
 
@@ -1,19 +1,27 @@
+import threading
 import unittest
-from io import BytesIO
+from io import BytesIO, StringIO
 
 import django
 from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import OperationalError, connection
+from django.test import TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 
 from rest_framework import status
-from rest_framework.test import APITestCase
+from rest_framework.test import APITestCase, APITransactionTestCase
 
 from PIL import Image
 
 from bans.models import Ban
+from core import background, pubsub
 from flags.models import Flag, FlagComment
+from users.models import Profile
 
 from . import get_postid
+from .bitmap import Bitmap
 from .models import *
 from .views import *
 
@@ -79,6 +87,17 @@ class StatusTest(APITestCase):
 
         self.assertFalse(p.active)
 
+    def test_active_filter(self):
+        """
+        Filtering the active flag should only return active posts
+        """
+        active = Post.objects.create(area=self.area, author=self.user, text="Example")
+        old = Post.objects.create(area=self.area, author=self.user, text="Example")
+        old.created = timezone.now() - datetime.timedelta(days=40)
+        old.save()
+        Post.objects.create(area=self.area, author=self.user, draft=True)
+
+        self.assertEqual(list(Post.all_objects.filter(active=True)), [active])
 
     def test_active_draft(self):
         """
@@ -179,6 +198,74 @@ class QueueTest(APITestCase):
             # Delete the post so it doesn't disturb any other test
             p.delete()
 
+    def test_fill_query_count(self):
+        """
+        Filling the stack should not need more queries, when more cards are missing
+        """
+        other = get_user_model().objects.create_user(
+            username='other', password='secret')
+
+        Post.objects.create(area=self.area, author=self.author)
+        with CaptureQueriesContext(connection) as one_card:
+            Post.get_stack(self.area, self.user)
+
+        for _ in range(12):
+            Post.objects.create(area=self.area, author=self.author)
+        with CaptureQueriesContext(connection) as full_stack:
+            stack = Post.get_stack(self.area, other)
+
+        self.assertEqual(stack.count(), 10)
+        self.assertLessEqual(len(full_stack), len(one_card))
+
+    def test_spread_stack_query_count(self):
+        """
+        Returning the refilled stack after spreading should not need more queries, when it has more cards
+        """
+        other = get_user_model().objects.create_user(
+            username='other', password='secret')
+
+        def spread(user):
+            post = Post.objects.create(area=self.area, author=self.author)
+            post.assign_user(user)
+            # Make sure all profiles exist, so they don't have to be created
+            for profileless in get_user_model().objects.filter(profile=None):
+                Profile.objects.get(user=profileless)
+
+            self.client.force_authenticate(user=user)
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.post(
+                    reverse('areas:spread', kwargs={'area': self.area, 'post': get_postid(post)}) + '?stack=true',
+                    {'spread': True})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            return response, len(queries)
+
+        commented = Post.objects.create(area=self.area, author=self.author)
+        commented.comment_set.create(author=self.author, text="Hi")
+        _, one_card = spread(self.user)
+
+        for _ in range(9):
+            post = Post.objects.create(area=self.area, author=self.author)
+            post.comment_set.create(author=self.author, text="Hi")
+        response, full_stack = spread(other)
+
+        self.assertEqual(len(response.data['stack']), 10)
+        self.assertLessEqual(full_stack, one_card)
+
+    def test_fill_excludes_done(self):
+        """
+        Posts the user already handled or has in his stack should not be assigned again
+        """
+        done = [Post.objects.create(area=self.area, author=self.author) for _ in range(5)]
+        for post in done:
+            post.stack_done.add(self.user)
+        assigned = Post.objects.create(area=self.area, author=self.author)
+        assigned.assign_user(self.user)
+        fresh = Post.objects.create(area=self.area, author=self.author)
+
+        stack = Post.get_stack(self.area, self.user)
+
+        self.assertEqual(set(stack), {assigned, fresh})
+
     def test_create_not_authenticated(self):
         """
         Unauthenticated users should not be able to Post
@@ -499,6 +586,64 @@ class AdditionalImagesTest(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
 
 
+class PostListQueryTest(APITestCase):
+    def setUp(self):
+        self.area = create_areas()
+        # Test User
+        self.user = get_user_model().objects.create_user(
+            username='user', password='secret')
+        self.banned = get_user_model().objects.create_user(
+            username='banned', password='secret')
+        Ban.objects.create(user=self.banned, ban_all=True)
+
+        self.client.force_authenticate(user=self.user)
+
+    def create_post(self, i):
+        author = get_user_model().objects.create_user(username='author%s' % i, password='secret')
+        post = Post.objects.create(area=self.area, author=author, text="Post %s" % i)
+        post.comment_set.create(author=author, text="Hi")
+        post.comment_set.create(author=self.banned, text="Hi")
+        post.subscriber.add(self.user)
+        return post
+
+    def get_subscribed(self):
+        # Make sure all profiles exist, so they don't have to be created
+        for user in get_user_model().objects.filter(profile=None):
+            Profile.objects.get(user=user)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('areas:subscribed', kwargs={'area': self.area}))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response, len(queries)
+
+    def test_query_count(self):
+        """
+        Listing posts should need the same number of queries, no matter how many posts there are
+        """
+        self.create_post(0)
+        _, one = self.get_subscribed()
+
+        for i in range(1, 5):
+            self.create_post(i)
+        response, many = self.get_subscribed()
+
+        self.assertEqual(len(response.data['results']), 5)
+        self.assertEqual(one, many)
+
+    def test_details(self):
+        """
+        The prefetched data should be the same as without prefetching
+        """
+        post = self.create_post(0)
+        response, _ = self.get_subscribed()
+        data = response.data['results'][0]
+
+        self.assertTrue(data['subscribed'])
+        self.assertEqual(data['author']['user'], post.author.pk)
+        self.assertFalse(data['author']['banned'])
+        self.assertEqual([comment['author']['banned'] for comment in data['comments']], [False, True])
+
+
 class DetailTest(APITestCase):
     def setUp(self):
         self.area = create_areas()
@@ -574,6 +719,25 @@ class DetailTest(APITestCase):
 
         self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
 
+    def test_delete_post_query_count(self):
+        """
+        Deleting a post should not need more queries, when it has more comments
+        """
+        def delete(count):
+            post = Post.objects.create(area=self.area, author=self.user_author, text="Hi there")
+            for _ in range(count):
+                post.comment_set.create(author=self.user, text="Hi")
+
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.delete(reverse('areas:detail', kwargs={'area': self.area, 'post': get_postid(post)}))
+            self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+            return len(queries)
+
+        self.client.force_authenticate(user=self.user_author)
+        few = delete(1)
+        many = delete(20)
+        self.assertLessEqual(many, few)
+
     def test_delete_others(self):
         """
         It should not be possible to delete other's post
@@ -597,6 +761,81 @@ class DetailTest(APITestCase):
 
         self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
 
+    def test_view_read_only(self):
+        """
+        Viewing a post without unread comments loads it once and writes nothing
+        """
+        Profile.objects.get(user=self.user_author)
+        self.post.comment_set.create(author=self.user_author, text="Hi")
+        Subscription.subscribe(self.post, self.user)
+
+        self.client.force_authenticate(user=self.user)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('areas:detail', kwargs={'area': self.area, 'post': get_postid(self.post)}))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        sql = [query['sql'] for query in queries]
+        self.assertEqual([q for q in sql if not q.startswith('SELECT')], [])
+        self.assertEqual(len([q for q in sql if q.startswith('SELECT "areas_post"."id"')]), 1)
+
+    def test_comments_after(self):
+        """
+        With ?after= only the post header and the newer comments are returned
+        """
+        comments = [self.post.comment_set.create(author=self.user, text="Hi %s" % i) for i in range(3)]
+        url = reverse('areas:detail', kwargs={'area': self.area, 'post': get_postid(self.post)})
+
+        response = self.client.get(url, {'after': comments[0].pk})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([comment['id'] for comment in response.data['comments']], [comments[1].pk, comments[2].pk])
+        self.assertNotIn('text', response.data)
+        self.assertEqual(response.data['author']['user'], self.user_author.pk)
+
+        response = self.client.get(url, {'after': comments[2].created.isoformat().replace('+00:00', 'Z')})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['comments'], [])
+
+    def test_comments_after_deleted(self):
+        """
+        The comment used as cursor might have been deleted in the meantime
+        """
+        first = self.post.comment_set.create(author=self.user, text="Hi")
+        second = self.post.comment_set.create(author=self.user, text="Hi")
+        first_pk = first.pk
+        first.delete()
+
+        response = self.client.get(
+            reverse('areas:detail', kwargs={'area': self.area, 'post': get_postid(self.post)}), {'after': first_pk})
+        self.assertEqual([comment['id'] for comment in response.data['comments']], [second.pk])
+
+    def test_comments_after_other_post(self):
+        """
+        Comments of other posts are not accepted as cursor
+        """
+        other = Post.objects.create(area=self.area, author=self.user_author, text="Other")
+        comment = other.comment_set.create(author=self.user, text="Hi")
+
+        response = self.client.get(
+            reverse('areas:detail', kwargs={'area': self.area, 'post': get_postid(self.post)}), {'after': comment.pk})
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_comments_after_invalid(self):
+        response = self.client.get(
+            reverse('areas:detail', kwargs={'area': self.area, 'post': get_postid(self.post)}), {'after': 'yesterday'})
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_comments_after_too_large(self):
+        response = self.client.get(
+            reverse('areas:detail', kwargs={'area': self.area, 'post': get_postid(self.post)}), {'after': '9' * 30})
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = self.client.get(
+            reverse('areas:detail', kwargs={'area': self.area, 'post': get_postid(self.post)}), {'after': '\u00b2'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
 
 class CommentTest(APITestCase):
     def setUp(self):
@@ -696,6 +935,347 @@ class CommentTest(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
         self.assertEqual(self.post.comment_set.count(), 1)
 
+    def test_list_comments(self):
+        """
+        The comments of a post can be paged through in both directions
+        """
+        comments = [self.post.comment_set.create(author=self.user, text="Hi %s" % i).pk for i in range(5)]
+        url = reverse('areas:comments', kwargs={'area': self.area, 'post': get_postid(self.post)})
+
+        pages = []
+        response = self.client.get(url, {'limit': 2})
+        while True:
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            pages.append([comment['id'] for comment in response.data['results']])
+            if response.data['next'] is None:
+                break
+            response = self.client.get(response.data['next'])
+        self.assertEqual(pages, [comments[0:2], comments[2:4], comments[4:5]])
+
+        response = self.client.get(response.data['previous'])
+        self.assertEqual([comment['id'] for comment in response.data['results']], comments[2:4])
+
+    def test_list_comments_invalid_cursor(self):
+        response = self.client.get(
+            reverse('areas:comments', kwargs={'area': self.area, 'post': get_postid(self.post)}), {'cursor': 'abc'})
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_embed_newest(self):
+        """
+        With ?comments=<n> only the newest comments are embedded, the cursor leads to older ones
+        """
+        comments = [self.post.comment_set.create(author=self.user, text="Hi %s" % i).pk for i in range(5)]
+
+        response = self.client.get(
+            reverse('areas:detail', kwargs={'area': self.area, 'post': get_postid(self.post)}), {'comments': 2})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([comment['id'] for comment in response.data['comments']], comments[3:5])
+
+        response = self.client.get(
+            reverse('areas:comments', kwargs={'area': self.area, 'post': get_postid(self.post)}),
+            {'cursor': response.data['comments_cursor'], 'limit': 2})
+        self.assertEqual([comment['id'] for comment in response.data['results']], comments[1:3])
+        self.assertIsNotNone(response.data['previous'])
+
+    def test_embed_all(self):
+        """
+        There is no cursor, when all comments are embedded
+        """
+        self.post.comment_set.create(author=self.user, text="Hi")
+
+        response = self.client.get(
+            reverse('areas:detail', kwargs={'area': self.area, 'post': get_postid(self.post)}), {'comments': 2})
+        self.assertEqual(len(response.data['comments']), 1)
+        self.assertIsNone(response.data['comments_cursor'])
+
+
+class StackPoolTest(APITestCase):
+    def setUp(self):
+        self.area = create_areas()
+        # Test User
+        self.user = get_user_model().objects.create_user(
+            username='user', password='secret')
+
+        self.author = get_user_model().objects.create_user(
+            username='author', password='secret')
+
+    def test_published(self):
+        """
+        Published posts should be in the pool, drafts not
+        """
+        post = Post.objects.create(area=self.area, author=self.author)
+        draft = Post.all_objects.create(area=self.area, author=self.author, draft=True)
+
+        self.assertEqual(StackPool.objects.get(post=post).outstanding, post.stack_outstanding)
+        self.assertFalse(StackPool.objects.filter(post=draft).exists())
+
+        draft.publish()
+        draft.save()
+        self.assertTrue(StackPool.objects.filter(post=draft).exists())
+
+    def test_assign_and_spread(self):
+        """
+        The outstanding spread of the pool should follow the post
+        """
+        post = Post.objects.create(area=self.area, author=self.author)
+        init_stack = post.stack_outstanding
+
+        Post.get_stack(self.area, self.user)
+        self.assertEqual(StackPool.objects.get(post=post).outstanding, init_stack - 1)
+
+        Post.add_outstanding([post.pk], 3)
+        post.refresh_from_db()
+        self.assertEqual(post.stack_outstanding, init_stack + 2)
+        self.assertEqual(StackPool.objects.get(post=post).outstanding, init_stack + 2)
+
+    def test_expired(self):
+        """
+        Expired posts should not be assigned and are removed by clearstackpool
+        """
+        post = Post.objects.create(area=self.area, author=self.author)
+        post.created = timezone.now() - datetime.timedelta(days=40)
+        post.save()
+
+        self.assertFalse(Post.get_stack(self.area, self.user).exists())
+
+        call_command('clearstackpool')
+        self.assertFalse(StackPool.objects.filter(post=post).exists())
+
+
+class BitmapTest(unittest.TestCase):
+    def test_add(self):
+        bitmap = Bitmap()
+        bitmap.update([1000, 5, 1003, 64])
+        bitmap.add(3)
+
+        self.assertEqual(list(bitmap), [3, 5, 64, 1000, 1003])
+        self.assertEqual(len(bitmap), 5)
+        self.assertIn(1003, bitmap)
+        self.assertNotIn(1001, bitmap)
+        self.assertNotIn(10**6, bitmap)
+
+    def test_serialize(self):
+        bitmap = Bitmap()
+        bitmap.update(range(10**5, 10**5 + 1000, 7))
+
+        copy = Bitmap(bitmap.offset, bitmap.to_bytes())
+        self.assertEqual(list(copy), list(bitmap))
+
+    def test_trim(self):
+        bitmap = Bitmap()
+        bitmap.update([3, 20, 40])
+        bitmap.trim(24)
+
+        self.assertNotIn(3, bitmap)
+        self.assertIn(40, bitmap)
+
+
+class StackSeenTest(APITestCase):
+    def setUp(self):
+        self.area = create_areas()
+        # Test User
+        self.user = get_user_model().objects.create_user(
+            username='user', password='secret')
+
+        self.author = get_user_model().objects.create_user(
+            username='author', password='secret')
+
+    def test_own_post(self):
+        """
+        Own posts are handled already
+        """
+        post = Post.objects.create(area=self.area, author=self.author)
+
+        self.assertIn(post.pk, StackSeen.get(self.author, self.area).get_posts())
+        self.assertFalse(Post.get_stack(self.area, self.author).exists())
+
+    def test_spread(self):
+        """
+        Spread posts should be marked as handled
+        """
+        post = Post.objects.create(area=self.area, author=self.author)
+        post.assign_user(self.user)
+
+        self.client.force_authenticate(user=self.user)
+        self.client.post(reverse('areas:spread', kwargs={'area': self.area, 'post': get_postid(post)}), {'spread': False})
+
+        self.assertIn(post.pk, StackSeen.get(self.user, self.area).get_posts())
+        self.assertFalse(Post.get_stack(self.area, self.user).exists())
+
+    def test_mostly_seen(self):
+        """
+        Filling the stack of a user who handled most posts should not scan the whole pool
+        """
+        for _ in range(120):
+            Post.objects.create(area=self.area, author=self.author)
+        with CaptureQueriesContext(connection) as few:
+            Post.get_stack(self.area, self.author)
+
+        for _ in range(120):
+            Post.objects.create(area=self.area, author=self.author)
+        with CaptureQueriesContext(connection) as many:
+            Post.get_stack(self.area, self.author)
+
+        self.assertEqual(len(few), len(many))
+
+    def test_clear(self):
+        """
+        clearstackdone should forget expired posts only
+        """
+        old = Post.objects.create(area=self.area, author=self.author)
+        old.created = timezone.now() - datetime.timedelta(days=40)
+        old.save()
+        active = Post.objects.create(area=self.area, author=self.author)
+
+        call_command('clearstackdone')
+
+        self.assertFalse(old.stack_done.exists())
+        self.assertTrue(active.stack_done.filter(pk=self.author.pk).exists())
+        posts = StackSeen.get(self.author, self.area).get_posts()
+        self.assertIn(active.pk, posts)
+
+
+class StackLeaseTest(APITestCase):
+    def setUp(self):
+        self.area = create_areas()
+        # Test User
+        self.user = get_user_model().objects.create_user(
+            username='user', password='secret')
+
+        self.author = get_user_model().objects.create_user(
+            username='author', password='secret')
+
+        self.posts = [Post.objects.create(area=self.area, author=self.author) for _ in range(2)]
+        self.init_stack = self.posts[0].stack_outstanding
+
+    def test_release(self):
+        """
+        Expired assignments should be removed and give their spread back
+        """
+        other = get_user_model().objects.create_user(
+            username='other', password='secret')
+        Post.get_stack(self.area, self.user)
+        Post.get_stack(self.area, other)
+        StackAssignment.objects.filter(user=self.user).update(leased_until=timezone.now() - datetime.timedelta(seconds=1))
+
+        call_command('releasestacks', stdout=StringIO())
+
+        self.assertFalse(self.user.post_assigned.exists())
+        self.assertEqual(other.post_assigned.count(), 2)
+        for post in self.posts:
+            post.refresh_from_db()
+            self.assertEqual(post.stack_outstanding, self.init_stack - 1)
+            self.assertEqual(post.stack_pool.outstanding, self.init_stack - 1)
+
+    def test_renew(self):
+        """
+        Leases should be renewed, when the stack is requested
+        """
+        Post.get_stack(self.area, self.user)
+        StackAssignment.objects.update(leased_until=timezone.now() + datetime.timedelta(hours=1))
+
+        Post.get_stack(self.area, self.user)
+
+        self.assertFalse(StackAssignment.objects.filter(leased_until__lt=timezone.now() + datetime.timedelta(days=1)).exists())
+
+    def test_renew_only_when_needed(self):
+        """
+        Requesting a stack with fresh leases should not write anything
+        """
+        Post.get_stack(self.area, self.user)
+
+        with CaptureQueriesContext(connection) as queries:
+            Post.get_stack(self.area, self.user)
+
+        self.assertFalse([query for query in queries if query['sql'].startswith('UPDATE')])
+
+
+class StackConcurrencyTest(TransactionTestCase):
+    def setUp(self):
+        self.area = create_areas()
+
+        self.author = get_user_model().objects.create_user(
+            username='author', password='secret')
+        self.users = [
+            get_user_model().objects.create_user(username='user%s' % i, password='secret') for i in range(12)
+        ]
+
+        self.posts = [Post.objects.create(area=self.area, author=self.author) for _ in range(3)]
+        self.spread = self.posts[0].stack_outstanding
+
+    def fill(self, user, barrier):
+        barrier.wait()
+        try:
+            for _ in range(20):
+                try:
+                    Post.get_stack(self.area, user)
+                    break
+                except OperationalError:
+                    # SQLite does not wait for locks of other connections
+                    continue
+        finally:
+            connection.close()
+
+    def test_parallel_fill(self):
+        """
+        Filling many stacks at the same time must never hand out a post more often than its spread allows
+        """
+        barrier = threading.Barrier(len(self.users))
+        threads = [threading.Thread(target=self.fill, args=(user, barrier)) for user in self.users]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        for post in self.posts:
+            post.refresh_from_db()
+            self.assertGreaterEqual(post.stack_outstanding, 0)
+            self.assertEqual(post.stack_outstanding + post.stack_assigned.count(), self.spread)
+
+
+class StackPrefillTest(APITransactionTestCase):
+    def setUp(self):
+        self.area = create_areas()
+        # Test User
+        self.user = get_user_model().objects.create_user(
+            username='user', password='secret')
+
+        self.author = get_user_model().objects.create_user(
+            username='author', password='secret')
+
+        self.posts = [Post.objects.create(area=self.area, author=self.author) for _ in range(11)]
+        self.stack = Post.get_stack(self.area, self.user)
+
+    def spread(self):
+        self.client.force_authenticate(user=self.user)
+        response = self.client.post(reverse(
+            'areas:spread',
+            kwargs={'area': self.area, 'post': get_postid(self.stack[0])}
+            ), {'spread': False})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    @override_settings(BACKGROUND_WORKERS=2, STACK_PREFILL=True)
+    def test_prefill(self):
+        """
+        The stack should be refilled in the background after spreading
+        """
+        self.spread()
+        background.pool.wait()
+
+        self.assertEqual(self.stack.count(), 10)
+
+    @override_settings(BACKGROUND_WORKERS=0, STACK_PREFILL=True)
+    def test_prefill_disabled(self):
+        """
+        Without workers the stack is refilled by the next queue request
+        """
+        self.spread()
+        self.assertEqual(self.stack.count(), 9)
+
+        response = self.client.get(reverse('areas:queue', kwargs={'area': self.area}))
+        self.assertEqual(response.data['count'], 10)
+
 
 class SpreadTest(APITestCase):
     def setUp(self):
@@ -759,6 +1339,23 @@ class SpreadTest(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(self.post.stack_outstanding, init_stack)
 
+    def test_include_stack(self):
+        """
+        With ?stack=true the refilled stack should be returned
+        """
+        self.post.stack_assigned.add(self.user)
+        other = Post.objects.create(area=self.area, author=self.user_author, text="Next")
+
+        self.client.force_authenticate(user=self.user)
+        response = self.client.post(reverse(
+            'areas:spread',
+            kwargs={'area': self.area, 'post': get_postid(self.post)}
+            ) + '?stack=true', {'spread': True})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.data['spread'])
+        self.assertEqual([post['id'] for post in response.data['stack']], [other.get_uri_key()])
+
     def test_not_queued(self):
         init_stack = self.post.stack_outstanding
 
@@ -773,6 +1370,80 @@ class SpreadTest(APITestCase):
         self.assertEqual(self.post.stack_outstanding, init_stack)
 
 
+class BatchSpreadTest(APITestCase):
+    def setUp(self):
+        self.area = create_areas()
+        # Test User
+        self.user = get_user_model().objects.create_user(
+            username='user', password='secret')
+
+        self.user_author = get_user_model().objects.create_user(
+            username='author', password='secret')
+
+        self.posts = [Post.objects.create(area=self.area, author=self.user_author, text="Hi there") for _ in range(3)]
+        Post.get_stack(self.area, self.user)
+        self.init_stack = Post.objects.get(pk=self.posts[0].pk).stack_outstanding
+
+        self.client.force_authenticate(user=self.user)
+
+    def spread(self, decisions, query=''):
+        return self.client.post(
+            reverse('areas:spread-batch', kwargs={'area': self.area}) + query,
+            {'posts': [{'id': get_postid(post), 'spread': spread} for post, spread in decisions]},
+            format='json')
+
+    def test_spread(self):
+        """
+        All posts should be removed from the stack, only the spread ones get spread
+        """
+        response = self.spread([(self.posts[0], True), (self.posts[1], False)])
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(list(Post.get_stack(self.area, self.user)), [self.posts[2]])
+        self.assertGreater(Post.objects.get(pk=self.posts[0].pk).stack_outstanding, self.init_stack)
+        self.assertEqual(Post.objects.get(pk=self.posts[1].pk).stack_outstanding, self.init_stack)
+        self.assertEqual(set(self.user.post_done.filter(area=self.area)), set(self.posts[:2]))
+
+    def test_too_many(self):
+        """
+        More posts than fit into a stack should be rejected
+        """
+        response = self.spread([(self.posts[0], True)] * (Post.MAX_USER_STACK + 1))
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('posts', response.data)
+
+    def test_not_queued(self):
+        """
+        Nothing should be changed, when one of the posts is not in the stack
+        """
+        other = Post.objects.create(area=self.area, author=self.user_author, text="Not queued")
+
+        response = self.spread([(self.posts[0], True), (other, True)])
+
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(self.user.post_assigned.count(), 3)
+        self.assertEqual(Post.objects.get(pk=self.posts[0].pk).stack_outstanding, self.init_stack)
+
+    def test_duplicate(self):
+        response = self.spread([(self.posts[0], True), (self.posts[0], False)])
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_query_count(self):
+        """
+        Spreading more posts should not need more queries
+        """
+        Reputation.get_spread(self.area, self.user)  # Created on first spread otherwise
+
+        with CaptureQueriesContext(connection) as one:
+            self.spread([(self.posts[0], True)])
+        with CaptureQueriesContext(connection) as two:
+            self.spread([(self.posts[1], True), (self.posts[2], False)])
+
+        self.assertEqual(len(one), len(two))
+
+
 class NotificationTest(APITestCase):
     def setUp(self):
         self.area = create_areas()
@@ -812,12 +1483,11 @@ class NotificationTest(APITestCase):
         """
         If a user has no notifications, he shoudn't see any
         """
-        self.user_author.comment_unread.clear()
+        Subscription.objects.filter(user=self.user_author).mark_read()
         self.client.force_authenticate(user=self.user_author)
         response = self.client.get(reverse('areas:notification'))
 
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(response.data['count'], 0)
         self.assertEqual(response.data['results'], [])
 
     def test_notification_get(self):
@@ -825,16 +1495,62 @@ class NotificationTest(APITestCase):
         A user should see their own notifications
         """
         # All comments are to the same post
-        self.post_comment();
-        self.post_comment();
-        self.post_comment();
+        comments = [self.post_comment().pk for _ in range(3)]
 
         self.client.force_authenticate(user=self.user_author)
         response = self.client.get(reverse('areas:notification') + "?limit=100")
 
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(response.data['count'], 1)
-        self.assertEqual(response.data['results'][0]['comments'], list(self.user_author.comment_unread.values_list('pk', flat=True)))
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertEqual(response.data['results'][0]['comments'], comments)
+        self.assertEqual(response.data['results'][0]['area'], self.area.name)
+
+    def get_notifications(self, **params):
+        # Make sure all profiles exist, so they don't have to be created
+        for user in get_user_model().objects.filter(profile=None):
+            Profile.objects.get(user=user)
+
+        self.client.force_authenticate(user=self.user_author)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('areas:notification'), params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response, len(queries)
+
+    def test_notification_query_count(self):
+        """
+        The number of queries doesn't depend on the number of posts and comments
+        """
+        self.post_comment()
+        _, one = self.get_notifications()
+
+        for i in range(3):
+            self.post = Post.objects.create(area=self.area, author=self.user_author, text="Post %s" % i)
+            self.post_comment()
+            self.post_comment()
+        response, many = self.get_notifications()
+
+        self.assertEqual(len(response.data['results']), 4)
+        self.assertEqual(one, many)
+
+    def test_notification_pages(self):
+        """
+        Notifications are paged by the most recent activity
+        """
+        posts = [self.post] + [
+            Post.objects.create(area=self.area, author=self.user_author, text="Post %s" % i) for i in range(2)]
+        for post in posts + [posts[0]]:
+            self.post = post
+            self.post_comment()
+
+        response, _ = self.get_notifications(limit=2)
+        self.assertEqual([entry['post']['id'] for entry in response.data['results']],
+                         [posts[0].get_uri_key(), posts[2].get_uri_key()])
+        self.assertEqual(len(response.data['results'][0]['comments']), 2)
+
+        self.client.force_authenticate(user=self.user_author)
+        response = self.client.get(response.data['next'])
+        self.assertEqual([entry['post']['id'] for entry in response.data['results']], [posts[1].get_uri_key()])
+        self.assertIsNone(response.data['next'])
 
     def test_subscribe_not_authenticated(self):
         """
@@ -860,6 +1576,27 @@ class NotificationTest(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertTrue(self.user in self.post.subscriber.all())
 
+    def test_subscribe_resolves_post_once(self):
+        self.client.force_authenticate(user=self.user)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.put(reverse(
+                'areas:subscribe',
+                kwargs={'area': self.area, 'post': get_postid(self.post)}
+                ), {'subscribed': True})
+
+        self.assertEqual(len([q for q in queries if '"areas_post"."nonce" =' in q['sql']]), 1)
+
+    def test_subscribe_existing_read(self):
+        """
+        Comments written before subscribing are not unread
+        """
+        self.post.comment_set.create(author=self.user_author, text="Hi")
+        Subscription.subscribe(self.post, self.user)
+
+        self.assertFalse(Subscription.unread_comments(self.user).exists())
+        comment = self.post.comment_set.create(author=self.user_author, text="Hi")
+        self.assertEqual(list(Subscription.unread_comments(self.user)), [comment])
+
     def test_unsubscribe(self):
         """
         Unsubscribe from a post
@@ -890,13 +1627,29 @@ class NotificationTest(APITestCase):
         self.post_comment()
         self.assertTrue(self.user in self.post.subscriber.all())
 
+    def test_comment_query_count(self):
+        """
+        Creating a comment shouldn't depend on the number of subscribers
+        """
+        self.post_comment()  # Subscribes self.user
+        with CaptureQueriesContext(connection) as few:
+            self.post_comment()
+
+        for i in range(10):
+            Subscription.subscribe(self.post, get_user_model().objects.create_user(username='sub%s' % i, password='secret'))
+        with CaptureQueriesContext(connection) as many:
+            self.post_comment()
+
+        self.assertEqual(len(few), len(many))
+
     def test_notifications(self):
         """
         Get Notifications
         """
         comment = self.post_comment()
 
-        self.assertTrue(comment in self.user_author.comment_unread.all())
+        self.assertTrue(comment in Subscription.unread_comments(self.user_author))
+        self.assertFalse(Subscription.unread_comments(self.user).exists())  # Own comments are read
 
     def test_mark_read(self):
         """
@@ -910,7 +1663,93 @@ class NotificationTest(APITestCase):
             kwargs={'area': self.area, 'post': get_postid(self.post)}
             ))
 
-        self.assertFalse(comment in self.user_author.comment_unread.all())
+        self.assertFalse(comment in Subscription.unread_comments(self.user_author))
+
+    def get_count(self):
+        self.client.force_authenticate(user=self.user_author)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('areas:notification-count'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data, len(queries)
+
+    def test_count(self):
+        """
+        The counter is created on the first request and kept up to date afterwards
+        """
+        self.post_comment()
+        self.post_comment()
+        other = Post.objects.create(area=self.area, author=self.user_author, text="Hi")
+
+        count, _ = self.get_count()
+        self.assertEqual(count, {'comments': 2, 'posts': 1})
+
+        self.post = other
+        self.post_comment()
+        self.post_comment()
+        count, queries = self.get_count()
+        self.assertEqual(count, {'comments': 4, 'posts': 2})
+        self.assertEqual(queries, 1)
+
+        self.client.get(reverse('areas:detail', kwargs={'area': self.area, 'post': get_postid(other)}))
+        count, _ = self.get_count()
+        self.assertEqual(count, {'comments': 2, 'posts': 1})
+
+        self.client.delete(reverse('areas:notification'))
+        count, _ = self.get_count()
+        self.assertEqual(count, {'comments': 0, 'posts': 0})
+
+    def test_count_deleted_comment(self):
+        """
+        Deleted comments are removed from the counter
+        """
+        self.get_count()
+        first = self.post_comment()
+        second = self.post_comment()
+
+        self.client.force_authenticate(user=self.user)
+        self.client.delete(reverse('areas:comment', kwargs={'area': self.area, 'post': get_postid(self.post), 'comment': second.pk}))
+        count, _ = self.get_count()
+        self.assertEqual(count, {'comments': 1, 'posts': 1})
+
+        self.client.force_authenticate(user=self.user)
+        self.client.delete(reverse('areas:comment', kwargs={'area': self.area, 'post': get_postid(self.post), 'comment': first.pk}))
+        count, _ = self.get_count()
+        self.assertEqual(count, {'comments': 0, 'posts': 0})
+
+    def test_count_deleted_post(self):
+        """
+        The unread comments of deleted posts are removed from the counter
+        """
+        self.get_count()
+        self.post_comment()
+        self.post_comment()
+
+        self.client.force_authenticate(user=self.user_author)
+        self.client.delete(reverse('areas:detail', kwargs={'area': self.area, 'post': get_postid(self.post)}))
+        count, _ = self.get_count()
+        self.assertEqual(count, {'comments': 0, 'posts': 0})
+
+    def test_count_created_before_added(self):
+        """
+        A counter counted before the comment was added, doesn't count it again
+        """
+        comment = self.post_comment()
+        UnreadCounter.objects.all().delete()
+
+        self.get_count()
+        UnreadCounter.add_comment(comment)
+        count, _ = self.get_count()
+        self.assertEqual(count, {'comments': 1, 'posts': 1})
+
+    def test_count_unsubscribe(self):
+        self.get_count()
+        self.post_comment()
+
+        self.client.force_authenticate(user=self.user_author)
+        self.client.put(reverse('areas:subscribe', kwargs={'area': self.area, 'post': get_postid(self.post)}), {'subscribed': False})
+
+        count, _ = self.get_count()
+        self.assertEqual(count, {'comments': 0, 'posts': 0})
 
     def test_mark_all_read(self):
         for _ in range(10):
@@ -921,7 +1760,7 @@ class NotificationTest(APITestCase):
         response = self.client.delete(reverse('areas:notification'))
 
         self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
-        self.assertFalse(self.user_author.comment_unread.exists())
+        self.assertFalse(Subscription.unread_comments(self.user_author).exists())
 
     def test_subscription_list(self):
         self.post.subscriber.add(self.user)
@@ -933,6 +1772,62 @@ class NotificationTest(APITestCase):
         self.assertEqual(len(response.data['results']), self.user.post_subscriber.count())
 
 
+class NotificationPollTest(APITransactionTestCase):
+    def setUp(self):
+        self.area = create_areas()
+        # Test User
+        self.user = get_user_model().objects.create_user(
+            username='user', password='secret')
+
+        self.author = get_user_model().objects.create_user(
+            username='author', password='secret')
+
+        self.post = Post.objects.create(area=self.area, author=self.author, text="Hi there")
+
+    def poll(self, client, params, responses):
+        try:
+            client.force_authenticate(user=self.author)
+            responses.append(client.get(reverse('areas:notification-poll'), params))
+        finally:
+            connection.close()
+
+    def test_changed(self):
+        """
+        The poll returns right away, if the client doesn't know the current count
+        """
+        self.post.comment_set.create(author=self.user, text="Hi")
+
+        responses = []
+        self.poll(self.client_class(), {'comments': 0, 'timeout': 10}, responses)
+        self.assertEqual(responses[0].data, {'comments': 1, 'posts': 1})
+
+    def test_timeout(self):
+        responses = []
+        self.poll(self.client_class(), {'comments': 0, 'timeout': 0}, responses)
+        self.assertEqual(responses[0].data, {'comments': 0, 'posts': 0})
+
+    @override_settings(NOTIFICATION_POLL_INTERVAL=30)
+    def test_wake_up(self):
+        """
+        A new comment wakes up the waiting poll request
+        """
+        UnreadCounter.get(self.author)  # SQLite can't write from both threads at once, the poll only reads
+
+        responses = []
+        thread = threading.Thread(target=self.poll, args=(self.client_class(), {'comments': 0, 'timeout': 20}, responses))
+        thread.start()
+
+        channel = UnreadCounter.get_channel(self.author.pk)
+        while channel not in pubsub.broker.channels():
+            thread.join(0.01)
+        thread.join(0.2)  # Let it read the counter and start waiting
+
+        self.post.comment_set.create(author=self.user, text="Hi")
+        thread.join(10)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(responses[0].data, {'comments': 1, 'posts': 1})
+
+
 class ReputationTest(APITestCase):
     def setUp(self):
         self.area = create_areas()
@@ -7,6 +7,8 @@ app_name = 'areas'
 urlpatterns = [
     # Notifications
     path('notification/', views.NotificationView.as_view(), name='notification'),
+    path('notification/count/', views.NotificationCountView.as_view(), name='notification-count'),
+    path('notification/poll/', views.NotificationPollView.as_view(), name='notification-poll'),
     path('<slug:area>/subscribed/', views.SubscribedView.as_view(), name='subscribed'),
     path('<slug:area>/<int:post>/subscribe/', views.SubscribeView.as_view(), name='subscribe'),
 
@@ -14,8 +16,10 @@ urlpatterns = [
     path('<slug:area>/', views.QueueView.as_view(), name='queue'),
     path('<slug:area>/own/', views.OwnView.as_view(), name='own'),
     path('<slug:area>/<int:post>/', views.DetailView.as_view(), name='detail'),
+    path('<slug:area>/<int:post>/comments/', views.CommentListView.as_view(), name='comments'),
     path('<slug:area>/<int:post>/<int:comment>/', views.CommentView.as_view(), name='comment'),
     path('<slug:area>/<int:post>/spread/', views.SpreadView.as_view(), name='spread'),
+    path('<slug:area>/spread/', views.BatchSpreadView.as_view(), name='spread-batch'),
 
     # Drafts
     path('<slug:area>/drafts/', views.DraftListView.as_view(), name='drafts'),
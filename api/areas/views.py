@@ -1,18 +1,25 @@
-import math
+import time
+from collections import defaultdict
 
-from django.db.models import F
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Max, Prefetch, Q
 from django.http import Http404
 from django.shortcuts import get_object_or_404
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 
 from rest_framework import generics, mixins, permissions, status
-from rest_framework.exceptions import MethodNotAllowed
+from rest_framework.exceptions import MethodNotAllowed, NotFound, PermissionDenied, ValidationError
 from rest_framework.response import Response
 
 from bans.permissions import MayComment, MayFlagComment, MayFlagPost, MayPost
+from core import background, pubsub
 from flags.serializers import FlagSerializer
 
-from . import serializers
-from .models import Area, Post, Reputation
+from . import serializers, split_postid
+from .models import Area, Comment, Post, Reputation, Subscription, UnreadCounter, get_author_queryset
+from .pagination import CommentPagination, NotificationPagination
 from .permissions import IsInStack, IsOwnerOrReadCreateOnly, IsOwnerOrReadOnly
 
 
@@ -30,52 +37,67 @@ class PostSerializerMixin(AreaMixin):
     def get_post_serializer_class(self):
         return serializers.PostSerializer
 
+    def get_comment_limit(self):
+        return CommentPagination.get_embed_limit(self.request)
+
 
 class PostObjectMixin(PostSerializerMixin):
     post_field = 'post'
+    _post = None
+    _post_checked = False
 
     def get_post_queryset(self):
         return Post.objects.filter(area=self.area)
 
+    def get_post_select_related(self):
+        """
+        Relations loaded with the post of the url
+        """
+        return ('area', 'author')
+
     def get_post(self, check_permissions=True):
-        queryset = self.filter_queryset(self.get_queryset())
-        post_id = self.kwargs[self.post_field]
-
-        if post_id == 0:
-            # We would get an math domain error with the next calculation when removing this.
-            raise Http404()
-
-        # We need a number that we can use to calculate the nonce and the pk from their combined value `(?<nonce>[1-9][0-9]{7})(?<pk>[1-9][0-9]*)`.
-        # To do this we need 10 to the power of the number of digits of pk.
-        operand = 10 ** (math.floor(math.log10(post_id)) + 1 - 8)  # `math.floor(math.log10(post_id)) + 1`: number of digits in post_id
-        nonce = post_id // operand
-        pk = post_id % operand
-
-        if pk < 0:
-            # We won't find a post for this, so no need to hit the database.
-            raise Http404()
-
-        obj = get_object_or_404(queryset, pk=pk, nonce=nonce)
-        if check_permissions:
-            self.check_object_permissions(self.request, obj)
-        return obj
+        """
+        Returns the post of the url, it is only loaded (and checked) once per request
+        """
+        if self._post is None:
+            queryset = self.filter_queryset(self.get_queryset()).select_related(*self.get_post_select_related())
+            ids = split_postid(self.kwargs[self.post_field])
+
+            if ids is None:
+                # We won't find a post for this, so no need to hit the database.
+                raise Http404()
+            pk, nonce = ids
+
+            self._post = get_object_or_404(queryset, pk=pk, nonce=nonce)
+
+        if check_permissions and not self._post_checked:
+            self.check_object_permissions(self.request, self._post)
+            self._post_checked = True
+        return self._post
 
 
 class CommentObjectMixin(PostObjectMixin):
     comment_field = 'comment'
+    _comment = None
+    _comment_checked = False
 
     def get_comment_serializer_class(self):
         return serializers.CommentSerializer
 
     def get_comment(self, check_permissions=True):
-        post = self.get_post(check_permissions=False)
-        comment = self.kwargs.get(self.comment_field)
+        """
+        Returns the comment of the url, it is only loaded (and checked) once per request
+        """
+        if self._comment is None:
+            post = self.get_post(check_permissions=False)
+            comment = self.kwargs.get(self.comment_field)
 
-        obj = get_object_or_404(post.comment_set.all(), pk=comment)
+            self._comment = get_object_or_404(post.comment_set.select_related('author'), pk=comment)
 
-        if check_permissions:
-            self.check_object_permissions(self.request, obj)
-        return obj
+        if check_permissions and not self._comment_checked:
+            self.check_object_permissions(self.request, self._comment)
+            self._comment_checked = True
+        return self._comment
 
 
 # region
@@ -83,6 +105,7 @@ class AreaView(generics.ListAPIView):
     queryset = Area.objects.all()
     serializer_class = serializers.AreaSerializer
     pagination_class = None
+    use_replica = True
 
 
 class QueueView(generics.ListCreateAPIView, PostSerializerMixin):
@@ -95,7 +118,7 @@ class QueueView(generics.ListCreateAPIView, PostSerializerMixin):
         return self.get_post_serializer_class()
 
     def get_queryset(self):
-        return Post.get_stack(self.area, self.request.user)
+        return Post.get_stack(self.area, self.request.user).with_details(self.request.user, self.get_comment_limit())
 
     def perform_create(self, serializer):
         serializer.save(author=self.request.user, area=self.area)
@@ -106,12 +129,14 @@ class OwnView(generics.ListAPIView, PostSerializerMixin):
     List own posts
     """
     permission_classes = (permissions.IsAuthenticated,)
+    use_replica = True
 
     def get_serializer_class(self):
         return self.get_post_serializer_class()
 
     def get_queryset(self):
-        return Post.objects.filter(area=self.area, author=self.request.user).order_by('-created')
+        return Post.objects.filter(area=self.area, author=self.request.user).order_by('-created').with_details(
+            self.request.user, self.get_comment_limit())
 
 
 class DetailView(generics.RetrieveDestroyAPIView, mixins.CreateModelMixin, CommentObjectMixin):  # PostObjectMixin included in CommentObjectMixin
@@ -119,6 +144,8 @@ class DetailView(generics.RetrieveDestroyAPIView, mixins.CreateModelMixin, Comme
     Retrive a specific post or post a comment
     """
     permission_classes = (IsOwnerOrReadCreateOnly, permissions.IsAuthenticatedOrReadOnly, MayComment)
+    use_replica = True
+    MAX_COMMENT_ID = 2 ** 31 - 1  # Largest value of the id column
 
     def get_serializer_class(self):
         if self.request.method == 'POST':
@@ -127,13 +154,67 @@ class DetailView(generics.RetrieveDestroyAPIView, mixins.CreateModelMixin, Comme
             return self.get_post_serializer_class()
 
     def get_queryset(self):
+        if self.request.method == 'GET':
+            if self.request.query_params.get('after'):
+                return self.get_post_queryset().with_header(self.request.user)
+            return self.get_post_queryset().with_details(self.request.user, self.get_comment_limit())
         return self.get_post_queryset()
 
-    def get(self, request, *args, **kwargs):
-        if self.request.user.is_authenticated:
-            user = self.request.user
-            user.comment_unread.remove(*user.comment_unread.filter(post=self.get_object()))
-        return super().get(request, *args, **kwargs)
+    def get_post_select_related(self):
+        if self.request.method == 'GET':
+            return ('area',)  # The author is prefetched with everything the serializer needs
+        return super().get_post_select_related()
+
+    def get_after_filter(self):
+        """
+        Filter for the comments after `?after=<comment id or timestamp>` or None to return the whole post
+        """
+        after = self.request.query_params.get('after')
+        if not after:
+            return None
+
+        if after.isdigit():
+            try:
+                after = int(after)
+            except ValueError:
+                after = None  # Other digits than 0-9
+            if after is None or after > self.MAX_COMMENT_ID:
+                raise ValidationError({'after': ["Invalid comment id."]})
+            comment = Comment.objects.filter(post=self.get_post(), pk=after).values('created').first()
+            if comment is None:
+                if Comment.objects.filter(pk=after).exists():
+                    raise ValidationError({'after': ["Comment %s doesn't belong to this post." % after]})
+                # The comment got deleted, newer comments have higher ids
+                return Q(pk__gt=after)
+            return Q(created__gt=comment['created']) | Q(created=comment['created'], pk__gt=after)
+
+        try:
+            timestamp = parse_datetime(after)
+        except ValueError:
+            timestamp = None
+        if timestamp is None:
+            raise ValidationError({'after': ["Expected a comment id or a timestamp."]})
+        if timezone.is_naive(timestamp):
+            timestamp = timezone.make_aware(timestamp, timezone.utc)
+        return Q(created__gt=timestamp)
+
+    def retrieve(self, request, *args, **kwargs):
+        post = self.get_object()
+        if request.user.is_authenticated:
+            # Mark the comments read after the response, so the request itself only reads
+            background.pool.defer(Subscription.mark_post_read, post, request.user)
+
+        after = self.get_after_filter()
+        if after is None:
+            return Response(self.get_serializer(post).data)
+
+        # Only the header of the post and the new comments
+        comments = Comment.objects.filter(after, post=post).order_by('created', 'pk').prefetch_related(
+            Prefetch('author', queryset=get_author_queryset()))
+
+        data = serializers.PostHeaderSerializer(post, context=self.get_serializer_context()).data
+        data['comments'] = serializers.CommentSerializer(comments, many=True, context=self.get_serializer_context()).data
+        return Response(data)
 
     def get_object(self):
         return self.get_post()
@@ -145,6 +226,26 @@ class DetailView(generics.RetrieveDestroyAPIView, mixins.CreateModelMixin, Comme
         return self.create(request, *args, **kwargs)
 
 
+class CommentListView(generics.ListAPIView, PostObjectMixin):
+    """
+    Page through the comments of a post
+    """
+    use_replica = True
+    serializer_class = serializers.CommentSerializer
+    pagination_class = CommentPagination
+
+    def get_queryset(self):
+        return self.get_post_queryset()
+
+    def list(self, request, *args, **kwargs):
+        comments = Comment.objects.filter(post=self.get_post()).prefetch_related(
+            Prefetch('author', queryset=get_author_queryset()))
+
+        page = self.paginate_queryset(comments)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+
 class CommentView(generics.RetrieveDestroyAPIView, CommentObjectMixin):
     """
     View a comment of a post
@@ -158,8 +259,45 @@ class CommentView(generics.RetrieveDestroyAPIView, CommentObjectMixin):
     def get_object(self):
         return self.get_comment()
 
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            UnreadCounter.remove_comment(instance)
+            instance.delete()
+
+
+class SpreadMixin(PostSerializerMixin):
+    """
+    Common response handling of the spread views
+    """
+    def include_stack(self):
+        """
+        Whether the refilled stack should be returned with the response (`?stack=true`)
+        """
+        return self.request.query_params.get('stack', '').lower() in ('1', 'true')
+
+    def spread_response(self, create):
+        with transaction.atomic():
+            response = create()
+            if response.status_code is status.HTTP_201_CREATED:
+                response.status_code = status.HTTP_200_OK
+
+                if self.include_stack():
+                    # Saves the client from requesting the queue right after spreading
+                    stack = Post.get_stack(self.area, self.request.user).with_details(
+                        self.request.user, self.get_comment_limit())
+                    response.data['stack'] = self.get_post_serializer_class()(
+                        stack, many=True, context=self.get_serializer_context()).data
+        return response
+
+    def prefill_stack(self):
+        if settings.STACK_PREFILL and not self.include_stack():
+            # Refill the stack now, so the next queue request only needs to read it.
+            # If the workers are busy, the queue request fills it as usual.
+            area, user = self.area, self.request.user
+            transaction.on_commit(lambda: background.pool.submit(Post.get_stack, area, user))
+
 
-class SpreadView(generics.CreateAPIView, PostObjectMixin):
+class SpreadView(generics.CreateAPIView, PostObjectMixin, SpreadMixin):
     """
     Spread a card
     """
@@ -170,23 +308,55 @@ class SpreadView(generics.CreateAPIView, PostObjectMixin):
         return self.get_post_queryset()
 
     def post(self, request, *args, **kwargs):
-        response = super().post(request, *args, **kwargs)
-        if response.status_code is status.HTTP_201_CREATED:
-            response.status_code = status.HTTP_200_OK
-        return response
+        return self.spread_response(lambda: super(SpreadView, self).post(request, *args, **kwargs))
 
     def perform_create(self, serializer):
         obj = self.get_post()
 
-        # Handle Spread
+        # Remove from stack and handle spread
         if serializer.validated_data.get('spread'):
-            obj.stack_outstanding = F('stack_outstanding') + obj.get_spread(self.area, self.request.user)
+            Post.remove_from_stack(self.area, self.request.user, spread=[obj.pk])
+        else:
+            Post.remove_from_stack(self.area, self.request.user, skipped=[obj.pk])
 
-        # Remove from stack
-        obj.stack_done.add(self.request.user)
-        obj.stack_assigned.remove(self.request.user)
-        obj.save()
+        self.prefill_stack()
+        serializer.save()
+
+
+class BatchSpreadView(generics.CreateAPIView, SpreadMixin):
+    """
+    Spread or skip multiple cards at once
+    """
+    serializer_class = serializers.BatchSpreadSerializer
+    permission_classes = (permissions.IsAuthenticated,)
+
+    def post(self, request, *args, **kwargs):
+        return self.spread_response(lambda: super(BatchSpreadView, self).post(request, *args, **kwargs))
 
+    def perform_create(self, serializer):
+        decisions = {}
+        for item in serializer.validated_data['posts']:
+            ids = split_postid(item['id'])
+            if ids is None:
+                raise NotFound()
+            if ids in decisions:
+                raise ValidationError({'posts': ["Post %s is listed more than once." % item['id']]})
+            decisions[ids] = item['spread']
+
+        # Check all posts are in the stack with one query
+        in_stack = set(Post.objects.filter(
+            area=self.area, stack_assigned__pk=self.request.user.pk, pk__in=[pk for pk, _ in decisions]
+        ).values_list('pk', 'nonce'))
+        if not in_stack.issuperset(decisions):
+            raise PermissionDenied(IsInStack.message)
+
+        Post.remove_from_stack(
+            self.area, self.request.user,
+            spread=[pk for (pk, _), spread in decisions.items() if spread],
+            skipped=[pk for (pk, _), spread in decisions.items() if not spread],
+        )
+
+        self.prefill_stack()
         serializer.save()
 # endregion
 
@@ -195,37 +365,100 @@ class SpreadView(generics.CreateAPIView, PostObjectMixin):
 class NotificationView(generics.ListAPIView):
     serializer_class = serializers.NotificationSerializer
     permission_classes = (permissions.IsAuthenticated,)
+    pagination_class = NotificationPagination
 
     def get_queryset(self):
-        notifications = {}
-        for comment in self.request.user.comment_unread.all():
-            if notifications.get(comment.post, None) is None:
-                notifications[comment.post] = {
-                    'area': comment.post.area.name,
-                    'post': comment.post,
-
-                    'comments': [],
-                }
-
-            notifications[comment.post]['comments'].append(comment.pk)
-        return list(notifications.values())
+        """
+        Posts with unread comments and the time of the newest one as activity, grouped in the database
+        """
+        return Subscription.unread_comments(self.request.user).values('post').annotate(activity=Max('created')).order_by()
+
+    def list(self, request, *args, **kwargs):
+        page = self.paginate_queryset(self.get_queryset())
+        pks = [entry['post'] for entry in page]
+
+        posts = Post.all_objects.select_related('area').prefetch_related(
+            Prefetch('author', queryset=get_author_queryset())).in_bulk(pks)
+        comments = defaultdict(list)
+        unread = Subscription.unread_comments(self.request.user).filter(post__in=pks)
+        for post, comment in unread.order_by('created', 'pk').values_list('post', 'pk'):
+            comments[post].append(comment)
+
+        notifications = [{
+            'area': posts[pk].area.name,
+            'post': posts[pk],
+
+            'comments': comments[pk],
+        } for pk in pks if pk in posts]  # Posts deleted since the page was read are left out
+        serializer = self.get_serializer(notifications, many=True)
+        return self.get_paginated_response(serializer.data)
 
     def delete(self, request):
-        request.user.comment_unread.clear()
+        with transaction.atomic():
+            Subscription.objects.filter(user=request.user).mark_read()
+            UnreadCounter.objects.filter(pk=request.user.pk).update(comments=0, posts=0)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
+class NotificationCountView(generics.RetrieveAPIView):
+    """
+    Number of unread comments and posts, without building the notifications
+    """
+    serializer_class = serializers.NotificationCountSerializer
+    permission_classes = (permissions.IsAuthenticated,)
+
+    def get_object(self):
+        return UnreadCounter.get(self.request.user)
+
+
+class NotificationPollView(NotificationCountView):
+    """
+    Waits until the number of unread comments differs from `?comments=<n>`, or the timeout is over
+    """
+    def get_timeout(self):
+        try:
+            timeout = float(self.request.query_params['timeout'])
+        except (KeyError, ValueError):
+            return settings.NOTIFICATION_POLL_TIMEOUT
+        return max(0, min(timeout, settings.NOTIFICATION_POLL_TIMEOUT))
+
+    def get_object(self):
+        try:
+            known = int(self.request.query_params['comments'])
+        except (KeyError, ValueError):
+            known = None
+        deadline = time.monotonic() + self.get_timeout()
+
+        # Subscribe before reading the counter, so no comment gets lost in between
+        with pubsub.broker.subscribe(UnreadCounter.get_channel(self.request.user.pk)) as listener:
+            while True:
+                counter = super().get_object()
+                remaining = deadline - time.monotonic()
+                if known is None or counter.comments != known or remaining <= 0:
+                    return counter
+
+                if not connection.in_atomic_block:
+                    # Don't keep a database connection open while waiting
+                    connection.close()
+                try:
+                    listener.get(timeout=min(remaining, settings.NOTIFICATION_POLL_INTERVAL))
+                except pubsub.Empty:
+                    pass  # Comments counted by other processes are not published here, check the counter again
+
+
 class SubscribedView(generics.ListAPIView, PostSerializerMixin):
     """
     List all posts subscribed to
     """
     permission_classes = (permissions.IsAuthenticated,)
+    use_replica = True
 
     def get_serializer_class(self):
         return self.get_post_serializer_class()
 
     def get_queryset(self):
-        return self.request.user.post_subscriber.filter(area=self.area).order_by('-created')
+        return self.request.user.post_subscriber.filter(area=self.area).order_by('-created').with_details(
+            self.request.user, self.get_comment_limit())
 
 
 class SubscribeView(generics.RetrieveUpdateAPIView, PostObjectMixin):
@@ -250,8 +483,9 @@ class SubscribeView(generics.RetrieveUpdateAPIView, PostObjectMixin):
         if subscribed is None:
             pass
         elif subscribed:
-            obj.subscriber.add(self.request.user)
+            Subscription.subscribe(obj, self.request.user)
         else:
+            Subscription.mark_post_read(obj, self.request.user)  # Remove the unread comments from the counter
             obj.subscriber.remove(self.request.user)
 
         serializer.save()
@@ -272,7 +506,7 @@ class DraftListView(OwnView, mixins.CreateModelMixin, DraftPostObjectMixin):
     Retrive or create draft posts
     """
     def get_queryset(self):
-        return self.get_draft_post_queryset()
+        return self.get_draft_post_queryset().with_details(self.request.user, self.get_comment_limit())
 
     def post(self, request, area):
         return self.create(request)
@@ -288,6 +522,10 @@ class DraftDetailView(DetailView, mixins.UpdateModelMixin, DraftPostObjectMixin)
     def get_queryset(self):
         return self.get_draft_post_queryset()
 
+    def get_post_select_related(self):
+        # Drafts are loaded without the prefetching of DetailView
+        return ('area', 'author')
+
     def post(self, request, area, pk, nonce):
         raise MethodNotAllowed("POST")
 
@@ -1,8 +1,13 @@
+from collections import defaultdict
 from enum import Enum
 
 from django.conf import settings
-from django.db import models
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import models, transaction
 from django.db.models import Q
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from django.utils import timezone
 
 from choices import BAN_REASON_CHOICES, BanReason
@@ -42,9 +47,13 @@ class ActiveBanManager(models.Manager):
             unbanned=False)
 
     def _may(self, action, user):
-        return not self.get_queryset().filter(
-            Q(**{'ban_' + action: True}) | Q(ban_all=True),
-            user=user).exists()
+        return BanState.get(user).may(action)
+
+    def banned(self, users):
+        """
+        Returns the primary keys of the banned users, with at most one query
+        """
+        return {pk for pk, state in BanState.get_many(users).items() if state.banned}
 
     def may_post(self, user):
         return self._may('post', user)
@@ -95,3 +104,89 @@ class Ban(BanBase, BanActionsMixin):
 
 class Warn(BanBase):
     pass
+
+
+class BanState:
+    """
+    Whether a user is banned and the actions they are banned from.
+
+    It's cached until the nearest expiry of the bans, or until a ban of the user is changed,
+    so checking if a user may do something doesn't need the database.
+    """
+    ACTIONS = ('all', 'post', 'comment', 'flag')
+
+    def __init__(self, banned=False, actions=frozenset()):
+        self.banned = banned
+        self.actions = actions
+
+    def may(self, action):
+        return not ({'all', action} & self.actions)
+
+    @staticmethod
+    def get_cache_key(user):
+        # date_joined tells users apart, should a primary key be used again
+        return 'bans:state:%s:%s' % (user.pk, user.date_joined.timestamp())
+
+    @classmethod
+    def load_many(cls, users):
+        """
+        Loads the ban states of users from the database with one query.
+        Returns (state, seconds it's valid) by primary key of the user.
+        """
+        bans = defaultdict(list)
+        fields = ['ban_' + action for action in cls.ACTIONS]
+        for ban in Ban.active.filter(user__in=users).values('user', 'expiry', *fields):
+            bans[ban['user']].append(ban)
+
+        states = {}
+        for user in users:
+            actions = set()
+            timeout = settings.BAN_CACHE_TIMEOUT
+            for ban in bans[user.pk]:
+                actions.update(action for action in cls.ACTIONS if ban['ban_' + action])
+                if ban['expiry'] is not None:
+                    timeout = min(timeout, (ban['expiry'] - timezone.now()).total_seconds())
+            states[user.pk] = cls(bool(bans[user.pk]), frozenset(actions)), max(int(timeout), 1)
+        return states
+
+    @classmethod
+    def get_many(cls, users):
+        """
+        Returns the ban states of users by primary key, the ones not cached are loaded with one query
+        """
+        keys = {cls.get_cache_key(user): user for user in users}
+        cached = cache.get_many(keys) if keys else {}
+        states = {keys[key].pk: cls(*value) for key, value in cached.items()}
+
+        missing = [user for key, user in keys.items() if key not in cached]
+        if missing:
+            # Cache the states with the same timeout together
+            by_timeout = defaultdict(dict)
+            loaded = cls.load_many(missing)
+            for user in missing:
+                state, timeout = loaded[user.pk]
+                states[user.pk] = state
+                by_timeout[timeout][cls.get_cache_key(user)] = (state.banned, state.actions)
+            for timeout, values in by_timeout.items():
+                cache.set_many(values, timeout)
+        return states
+
+    @classmethod
+    def get(cls, user):
+        return cls.get_many([user])[user.pk]
+
+    @classmethod
+    def clear(cls, user):
+        key = cls.get_cache_key(user)
+        cache.delete(key)
+        # Requests running before the commit might have cached the old state again
+        transaction.on_commit(lambda: cache.delete(key))
+
+
+@receiver([post_save, post_delete], sender=Ban)
+def clear_ban_state(sender, instance, **kwargs):
+    try:
+        user = instance.user
+    except get_user_model().DoesNotExist:
+        return  # The user got deleted, so nobody uses the state anymore
+    BanState.clear(user)
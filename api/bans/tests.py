@@ -2,13 +2,15 @@ from datetime import timedelta
 
 import django
 from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.utils import timezone
 
 from rest_framework import status
 from rest_framework.test import APITestCase
 
-from .models import Ban, Warn
+from .models import Ban, BanState, Warn
 from .views import BanView
 
 
@@ -88,3 +90,64 @@ class BanTest(APITestCase):
 
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertTrue(response.data['banned'])
+
+
+class BanStateTest(APITestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            username='user', password='secret')
+
+    def test_cached(self):
+        """
+        The state is only loaded once
+        """
+        self.assertTrue(Ban.active.may_post(self.user))
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertTrue(Ban.active.may_post(self.user))
+            self.assertTrue(Ban.active.may_comment(self.user))
+        self.assertEqual(len(queries), 0)
+
+    def test_changed(self):
+        """
+        Changing a ban clears the cached state
+        """
+        self.assertTrue(Ban.active.may_comment(self.user))
+
+        ban = Ban.objects.create(user=self.user, ban_comment=True)
+        self.assertFalse(Ban.active.may_comment(self.user))
+        self.assertTrue(Ban.active.may_post(self.user))
+
+        ban.unbanned = True
+        ban.save()
+        self.assertTrue(Ban.active.may_comment(self.user))
+
+        Ban.objects.create(user=self.user, ban_all=True).delete()
+        self.assertTrue(Ban.active.may_flag(self.user))
+
+    def test_timeout(self):
+        """
+        The state is cached until the ban expires
+        """
+        Ban.objects.create(user=self.user, ban_post=True, expiry=timezone.now() + timedelta(seconds=30))
+
+        state, timeout = BanState.load_many([self.user])[self.user.pk]
+        self.assertTrue(state.banned)
+        self.assertFalse(state.may('post'))
+        self.assertLessEqual(timeout, 30)
+
+    def test_banned_many(self):
+        """
+        The banned users of a list are found with one query, or none if they are cached
+        """
+        users = [get_user_model().objects.create_user(username='user%s' % i, password='secret') for i in range(5)]
+        Ban.objects.create(user=users[1], ban_all=True)
+        Ban.objects.create(user=users[3], ban_flag=True, unbanned=True)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(Ban.active.banned(users), {users[1].pk})
+        self.assertEqual(len(queries), 1)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(Ban.active.banned(users), {users[1].pk})
+        self.assertEqual(len(queries), 0)
@@ -0,0 +1,92 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    Token authentication, that remembers the users of recently used tokens.
+
+    The fields of the users (except the password) are kept for TOKEN_CACHE_TIMEOUT seconds in a
+    LRU cache of the process, with at most TOKEN_CACHE_SIZE entries.
+    With TOKEN_CACHE_SHARED the default cache is used instead, so all processes see it, when a
+    token is cleared, because it's deleted or its user is changed.
+    """
+    _lock = threading.Lock()
+    _local = OrderedDict()
+
+    @staticmethod
+    def get_cache_key(key):
+        # Don't leak the tokens into the shared cache
+        return 'auth:token:%s' % hashlib.sha256(key.encode()).hexdigest()
+
+    @classmethod
+    def get_cached(cls, key):
+        """
+        Returns the field values of the user or None
+        """
+        if settings.TOKEN_CACHE_SHARED:
+            return cache.get(cls.get_cache_key(key))
+
+        with cls._lock:
+            entry = cls._local.get(key)
+            if entry is not None:
+                values, expires = entry
+                if expires > time.monotonic():
+                    cls._local.move_to_end(key)
+                    return values
+                del cls._local[key]
+        return None
+
+    @classmethod
+    def remember(cls, key, values):
+        if settings.TOKEN_CACHE_SHARED:
+            cache.set(cls.get_cache_key(key), values, settings.TOKEN_CACHE_TIMEOUT)
+        elif settings.TOKEN_CACHE_SIZE > 0:
+            with cls._lock:
+                cls._local[key] = (values, time.monotonic() + settings.TOKEN_CACHE_TIMEOUT)
+                cls._local.move_to_end(key)
+                while len(cls._local) > settings.TOKEN_CACHE_SIZE:
+                    cls._local.popitem(last=False)
+
+    @classmethod
+    def clear(cls, key):
+        def delete():
+            with cls._lock:
+                cls._local.pop(key, None)
+            if settings.TOKEN_CACHE_SHARED:
+                cache.delete(cls.get_cache_key(key))
+
+        delete()
+        # Requests running before the commit might have cached the old user again
+        transaction.on_commit(delete)
+
+    @staticmethod
+    def get_fields():
+        # The password hash is not needed to authenticate requests, so it's deferred
+        return [field.attname for field in get_user_model()._meta.concrete_fields if field.attname != 'password']
+
+    def authenticate_credentials(self, key):
+        values = self.get_cached(key)
+        if values is None:
+            user, token = super().authenticate_credentials(key)
+            self.remember(key, tuple(getattr(user, field) for field in self.get_fields()))
+            return user, token
+
+        # Every request gets its own instance, so nothing is cached on a shared one
+        user = get_user_model().from_db(DEFAULT_DB_ALIAS, self.get_fields(), values)
+        if not user.is_active:
+            raise exceptions.AuthenticationFailed('User inactive or deleted.')
+
+        token = self.get_model()(key=key, user=user)
+        token._state.adding = False
+        return user, token
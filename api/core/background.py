@@ -0,0 +1,87 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from django.conf import settings
+from django.db import connections, transaction
+
+logger = logging.getLogger(__name__)
+
+
+class BackgroundPool:
+    """
+    Runs tasks in a small pool of threads of the current process.
+
+    The number of threads is set with BACKGROUND_WORKERS, 0 disables the pool.
+    Tasks are never queued behind a busy pool, submit() rejects them instead,
+    so the caller can fall back to doing the work synchronously.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._executor = None
+        self._slots = None
+        self._pending = set()
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(settings.BACKGROUND_WORKERS, thread_name_prefix='background')
+                self._slots = threading.BoundedSemaphore(settings.BACKGROUND_WORKERS)
+            return self._executor
+
+    @property
+    def enabled(self):
+        return settings.BACKGROUND_WORKERS > 0
+
+    def submit(self, func, *args, **kwargs):
+        """
+        Runs func in the background.
+        Returns False, if the pool is disabled or all workers are busy.
+        """
+        if not self.enabled:
+            return False
+
+        executor = self._get_executor()
+        if not self._slots.acquire(blocking=False):
+            return False
+
+        future = executor.submit(self._run, func, args, kwargs)
+        with self._lock:
+            self._pending.add(future)
+        future.add_done_callback(self._done)
+        return True
+
+    def defer(self, func, *args, **kwargs):
+        """
+        Runs func in the background after the current transaction is committed.
+        If the pool is disabled, func runs right away, if it's busy after the commit.
+        """
+        if not self.enabled:
+            func(*args, **kwargs)
+        else:
+            transaction.on_commit(lambda: self.submit(func, *args, **kwargs) or func(*args, **kwargs))
+
+    def _run(self, func, args, kwargs):
+        try:
+            func(*args, **kwargs)
+        except Exception:
+            logger.exception("Background task %s failed", func)
+        finally:
+            self._slots.release()
+            # Every thread has its own connections, don't leave them open
+            connections.close_all()
+
+    def _done(self, future):
+        with self._lock:
+            self._pending.discard(future)
+
+    def wait(self, timeout=None):
+        """
+        Waits until all submitted tasks are done
+        """
+        with self._lock:
+            pending = set(self._pending)
+        wait(pending, timeout)
+
+
+pool = BackgroundPool()
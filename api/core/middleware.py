@@ -0,0 +1,49 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+
+from . import routers
+
+
+class ReplicaMiddleware:
+    """
+    Lets safe requests to views with `use_replica = True` read from the replicas.
+
+    After a request wrote to the database, the client is pinned to the primary for
+    REPLICA_PIN_TIMEOUT seconds, so it doesn't read anything older than its own changes.
+    Clients are told apart by their Authorization header or session cookie,
+    because the user is not authenticated before the view runs.
+    """
+    safe_methods = ('GET', 'HEAD', 'OPTIONS')
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        routers.use_replica(False)
+        try:
+            response = self.get_response(request)
+            if routers.has_written():
+                key = self.get_pin_key(request)
+                if key is not None:
+                    cache.set(key, True, settings.REPLICA_PIN_TIMEOUT)
+            return response
+        finally:
+            routers.use_replica(False)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        view = getattr(view_func, 'cls', getattr(view_func, 'view_class', None))
+        if not settings.DATABASE_REPLICAS or request.method not in self.safe_methods:
+            return
+        if not getattr(view, 'use_replica', False):
+            return
+
+        key = self.get_pin_key(request)
+        routers.use_replica(key is None or not cache.get(key))
+
+    def get_pin_key(self, request):
+        client = request.META.get('HTTP_AUTHORIZATION') or request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+        if not client:
+            return None
+        return 'replica:pin:%s' % hashlib.sha256(client.encode()).hexdigest()
@@ -1,6 +1,12 @@
 from django.contrib.auth.models import AbstractUser, UserManager
 from django.core.exceptions import ValidationError
 from django.db import models
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from rest_framework.authtoken.models import Token
+
+from .authentication import CachedTokenAuthentication
 
 
 class UserManager(UserManager):
@@ -45,3 +51,15 @@ class User(AbstractUser):
 
         if errors:
             raise ValidationError(errors)
+
+
+@receiver(post_delete, sender=Token)
+def clear_token(sender, instance, **kwargs):
+    CachedTokenAuthentication.clear(instance.key)
+
+
+@receiver(post_save, sender=User)
+def clear_user_tokens(sender, instance, created, **kwargs):
+    if not created:
+        for key in Token.objects.filter(user=instance).values_list('key', flat=True):
+            CachedTokenAuthentication.clear(key)
@@ -0,0 +1,132 @@
+from base64 import b64decode, b64encode
+from binascii import Error as Base64Error
+from collections import OrderedDict
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Paginates by the position in the ordering instead of an offset.
+
+    The fields in `ordering` (prefixed with '-' for descending) must be unique together,
+    so the database can jump directly to the position through an index.
+    Annotations can be used as well and the queryset may return dicts.
+    The cursor is the position of the last returned object (or the first one, when going backwards).
+    A backwards cursor without a position starts at the end.
+    """
+    ordering = ('pk',)
+    page_size = api_settings.PAGE_SIZE
+    max_page_size = api_settings.PAGE_SIZE
+    page_size_query_param = 'limit'
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def get_fields(self):
+        """
+        Returns the ordering as (field, descending) pairs
+        """
+        return [(field.lstrip('-'), field.startswith('-')) for field in self.ordering]
+
+    def get_value(self, obj, field):
+        return obj[field] if isinstance(obj, dict) else getattr(obj, field)
+
+    def encode_cursor(self, obj, reverse=False):
+        values = [str(self.get_value(obj, field)) for field, _ in self.get_fields()] if obj is not None else []
+        position = '\n'.join(['r' if reverse else 'f'] + values)
+        return b64encode(position.encode()).decode()
+
+    def decode_cursor(self, cursor, queryset):
+        """
+        Returns (values, reverse) of the cursor, values is None for the end
+        """
+        try:
+            direction, *values = b64decode(cursor.encode(), validate=True).decode().split('\n')
+            if direction == 'r' and not values:
+                return None, True
+            if direction not in ('f', 'r') or len(values) != len(self.ordering):
+                raise ValueError()
+            values = [
+                self.get_model_field(queryset, field).to_python(value)
+                for (field, _), value in zip(self.get_fields(), values)
+            ]
+        except (Base64Error, UnicodeDecodeError, ValueError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+        return values, direction == 'r'
+
+    def get_model_field(self, queryset, field):
+        if field in queryset.query.annotations:
+            return queryset.query.annotations[field].output_field
+        return queryset.model._meta.get_field(field)
+
+    def get_position_filter(self, values, reverse):
+        """
+        Filter for everything after (or before when reverse) the position
+        """
+        fields = self.get_fields()
+        position = None
+        for (field, descending), value in reversed(list(zip(fields, values))):
+            q = Q(**{field + ('__lt' if descending != reverse else '__gt'): value})
+            position = q if position is None else q | (Q(**{field: value}) & position)
+        return position
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        page_size = self.get_page_size(request)
+
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            values, self.reverse = self.decode_cursor(cursor, queryset)
+            if values is not None:
+                queryset = queryset.filter(self.get_position_filter(values, self.reverse))
+        else:
+            self.reverse = False
+
+        queryset = queryset.order_by(*[
+            ('-' if descending != self.reverse else '') + field for field, descending in self.get_fields()])
+
+        page = list(queryset[:page_size + 1])
+        has_more = len(page) > page_size
+        page = page[:page_size]
+        if self.reverse:
+            page.reverse()
+
+        # Going forward we know if there are more objects, and came from somewhere if there is a cursor
+        self.has_next = has_more if not self.reverse else bool(cursor)
+        self.has_previous = has_more if self.reverse else bool(cursor)
+        self.page = page
+        return page
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return replace_query_param(self.base_url, self.cursor_query_param, self.encode_cursor(self.page[-1]))
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return replace_query_param(self.base_url, self.cursor_query_param, self.encode_cursor(self.page[0], reverse=True))
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
@@ -0,0 +1,71 @@
+import threading
+from collections import defaultdict
+from queue import Empty, Queue  # noqa: F401 (Empty is used through this module)
+
+
+class Broker:
+    """
+    Publish / subscribe between the threads of the current process.
+
+    Messages are only delivered to the listeners of the channel at the time they are published,
+    so listeners have to subscribe before they check the state they are waiting for.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._listeners = defaultdict(set)
+
+    def subscribe(self, channel):
+        listener = Listener(self, channel)
+        with self._lock:
+            self._listeners[channel].add(listener)
+        return listener
+
+    def unsubscribe(self, listener):
+        with self._lock:
+            listeners = self._listeners.get(listener.channel)
+            if listeners is not None:
+                listeners.discard(listener)
+                if not listeners:
+                    del self._listeners[listener.channel]
+
+    def channels(self):
+        """
+        Returns the channels that have listeners
+        """
+        with self._lock:
+            return set(self._listeners)
+
+    def publish(self, channel, message=None):
+        """
+        Sends message to all listeners of channel and returns their number
+        """
+        with self._lock:
+            listeners = list(self._listeners.get(channel, ()))
+        for listener in listeners:
+            listener.queue.put(message)
+        return len(listeners)
+
+
+class Listener:
+    """
+    Receives the messages of a channel, use it as context manager to unsubscribe at the end
+    """
+    def __init__(self, broker, channel):
+        self.broker = broker
+        self.channel = channel
+        self.queue = Queue()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.broker.unsubscribe(self)
+
+    def get(self, timeout=None):
+        """
+        Waits for the next message, raises Empty on timeout
+        """
+        return self.queue.get(timeout=timeout)
+
+
+broker = Broker()
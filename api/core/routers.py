@@ -0,0 +1,56 @@
+import random
+import threading
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+_state = threading.local()
+
+
+def use_replica(enabled=True):
+    """
+    Allows (or forbids) reading from the replicas in the current thread
+    """
+    _state.replica = enabled
+    _state.written = False
+
+
+def has_written():
+    """
+    Whether the current thread wrote to the primary since use_replica() was called
+    """
+    return getattr(_state, 'written', False)
+
+
+class ReplicaRouter:
+    """
+    Sends reads to one of the DATABASE_REPLICAS, when the current thread allows it.
+
+    The replicas lag behind the primary, so only reads of threads, that called use_replica(), go
+    there. Once something was written (or a transaction is open) everything else goes to the
+    primary as well, so the thread sees its own writes.
+    Tokens and sessions are always read from the primary, a client that just logged in isn't pinned
+    yet, because it had no credentials to tell it apart.
+    """
+    primary_apps = ('authtoken', 'sessions')
+
+    def db_for_read(self, model, **hints):
+        if not settings.DATABASE_REPLICAS or not getattr(_state, 'replica', False) or has_written():
+            return None
+        if model._meta.app_label in self.primary_apps:
+            return DEFAULT_DB_ALIAS
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return None
+        return random.choice(settings.DATABASE_REPLICAS)
+
+    def db_for_write(self, model, **hints):
+        _state.written = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replicas contain the same data as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # The replicas get their tables through the replication
+        return db not in settings.DATABASE_REPLICAS
@@ -1,7 +1,21 @@
+import unittest
 from io import StringIO
 
+from django.contrib.sessions.models import Session
 from django.core import management
-from django.test import TestCase
+from django.core.cache import cache
+from django.db import router
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import AuthenticationFailed
+
+from . import routers
+from .authentication import CachedTokenAuthentication
+from .middleware import ReplicaMiddleware
+from .models import User
+from .pubsub import Broker, Empty
 
 
 class MigrationsTest(TestCase):
@@ -15,3 +29,174 @@ class MigrationsTest(TestCase):
 
         if failed:
             self.fail("Not all migrations are generated")
+
+
+class BrokerTest(unittest.TestCase):
+    def test_publish(self):
+        broker = Broker()
+        with broker.subscribe('a') as first, broker.subscribe('a') as second, broker.subscribe('b') as other:
+            self.assertEqual(broker.channels(), {'a', 'b'})
+            self.assertEqual(broker.publish('a', 1), 2)
+
+            self.assertEqual(first.get(timeout=0), 1)
+            self.assertEqual(second.get(timeout=0), 1)
+            with self.assertRaises(Empty):
+                other.get(timeout=0)
+
+    def test_unsubscribe(self):
+        broker = Broker()
+        with broker.subscribe('a'):
+            pass
+
+        self.assertEqual(broker.channels(), set())
+        self.assertEqual(broker.publish('a'), 0)
+
+
+@override_settings(DATABASE_REPLICAS=['replica'])
+class ReplicaRouterTest(SimpleTestCase):
+    def tearDown(self):
+        routers.use_replica(False)
+
+    def test_read(self):
+        self.assertEqual(router.db_for_read(User), 'default')
+
+        routers.use_replica()
+        self.assertEqual(router.db_for_read(User), 'replica')
+
+    def test_credentials(self):
+        """
+        Clients that just logged in are not pinned yet, so their credentials must be read from the primary
+        """
+        routers.use_replica()
+        self.assertEqual(router.db_for_read(Token), 'default')
+        self.assertEqual(router.db_for_read(Session), 'default')
+
+    def test_written(self):
+        routers.use_replica()
+        self.assertEqual(router.db_for_write(User), 'default')
+        self.assertEqual(router.db_for_read(User), 'default')
+
+    def test_migrate(self):
+        self.assertTrue(router.allow_migrate('default', 'core'))
+        self.assertFalse(router.allow_migrate('replica', 'core'))
+
+
+@override_settings(DATABASE_REPLICAS=['replica'])
+class ReplicaMiddlewareTest(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.factory = RequestFactory()
+        self.used = []
+
+    def request(self, method='get', replica=True, **extra):
+        class View:
+            use_replica = replica
+
+        def view(request):
+            self.used.append(router.db_for_read(User))
+            if request.method == 'POST':
+                router.db_for_write(User)
+            return HttpResponse()
+        view.cls = View
+
+        def get_response(request):
+            # Like the handler, which calls process_view() within the middleware
+            middleware.process_view(request, view, (), {})
+            return view(request)
+
+        middleware = ReplicaMiddleware(get_response)
+        return middleware(getattr(self.factory, method)('/', **extra))
+
+    def test_safe(self):
+        self.request()
+        self.request('post')
+        self.request(replica=False)
+        self.assertEqual(self.used, ['replica', 'default', 'default'])
+
+    def test_reset(self):
+        self.request()
+        self.assertEqual(router.db_for_read(User), 'default')
+
+    def test_pinned(self):
+        self.request('post', HTTP_AUTHORIZATION='Token a')
+        self.request(HTTP_AUTHORIZATION='Token a')
+        self.request(HTTP_AUTHORIZATION='Token b')
+        self.assertEqual(self.used, ['default', 'default', 'replica'])
+
+        with override_settings(REPLICA_PIN_TIMEOUT=0):
+            self.request('post', HTTP_AUTHORIZATION='Token b')
+        self.request(HTTP_AUTHORIZATION='Token b')
+        self.assertEqual(self.used[-1], 'replica')
+
+
+class CachedTokenAuthenticationTest(TestCase):
+    def setUp(self):
+        CachedTokenAuthentication._local.clear()
+        cache.clear()
+        self.user = User.objects.create_user(username='user', password='secret')
+        self.token = Token.objects.create(user=self.user)
+        self.auth = CachedTokenAuthentication()
+
+    def test_cached(self):
+        self.auth.authenticate_credentials(self.token.key)
+
+        with self.assertNumQueries(0):
+            user, token = self.auth.authenticate_credentials(self.token.key)
+        self.assertEqual(user, self.user)
+        self.assertEqual(token, self.token)
+
+        # Every request gets its own instance
+        self.assertIsNot(self.auth.authenticate_credentials(self.token.key)[0], user)
+
+    def test_deleted(self):
+        key = self.token.key
+        self.auth.authenticate_credentials(key)
+        self.token.delete()
+
+        with self.assertRaises(AuthenticationFailed):
+            self.auth.authenticate_credentials(key)
+
+    def test_user_changed(self):
+        self.auth.authenticate_credentials(self.token.key)
+        self.user.is_active = False
+        self.user.save()
+
+        with self.assertRaises(AuthenticationFailed):
+            self.auth.authenticate_credentials(self.token.key)
+
+    @override_settings(TOKEN_CACHE_SIZE=1)
+    def test_size(self):
+        other = Token.objects.create(user=User.objects.create_user(username='other', password='secret'))
+        self.auth.authenticate_credentials(self.token.key)
+        self.auth.authenticate_credentials(other.key)
+
+        self.assertEqual(list(CachedTokenAuthentication._local), [other.key])
+
+    @override_settings(TOKEN_CACHE_TIMEOUT=0)
+    def test_timeout(self):
+        self.auth.authenticate_credentials(self.token.key)
+
+        with self.assertNumQueries(1):
+            self.auth.authenticate_credentials(self.token.key)
+
+    @override_settings(TOKEN_CACHE_SHARED=True)
+    def test_shared(self):
+        self.auth.authenticate_credentials(self.token.key)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.auth.authenticate_credentials(self.token.key)[0], self.user)
+
+        # Nothing is kept in the process, that other processes couldn't clear
+        self.assertFalse(CachedTokenAuthentication._local)
+        key = self.token.key
+        self.token.delete()
+        with self.assertRaises(AuthenticationFailed):
+            self.auth.authenticate_credentials(key)
+
+    @override_settings(TOKEN_CACHE_SHARED=True)
+    def test_password_not_cached(self):
+        self.auth.authenticate_credentials(self.token.key)
+
+        user, _ = self.auth.authenticate_credentials(self.token.key)
+        self.assertIn('password', user.get_deferred_fields())
+        self.assertTrue(user.check_password('secret'))
@@ -0,0 +1,17 @@
+# Gunicorn settings of the docker image
+# http://docs.gunicorn.org/en/stable/settings.html
+import os
+
+bind = '0.0.0.0:80'
+
+# Requests run in greenlets, so notification polls waiting for new comments don't hold a
+# thread each. They close their database connection while waiting.
+worker_class = 'gevent'
+workers = int(os.environ.get('GUNICORN_WORKERS', '1'))
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', '1000'))
+
+
+def post_fork(server, worker):
+    # Let psycopg2 wait for the database cooperatively instead of blocking the whole worker
+    from psycogreen.gevent import patch_psycopg
+    patch_psycopg()
@@ -65,6 +65,35 @@ DATABASES = {
     }
 }
 
+# Read replicas of the default database, as a comma separated list of hosts
+DATABASE_REPLICAS = []
+for i, host in enumerate(filter(None, os.environ.get('DB_REPLICA_HOSTS', '').split(','))):
+    DATABASES['replica%s' % i] = dict(DATABASES['default'], HOST=host.strip())
+    DATABASE_REPLICAS.append('replica%s' % i)
+
+# Use the shared cache, so all processes pin clients to the default database after they wrote
+REPLICA_PIN_TIMEOUT = int(os.environ.get('REPLICA_PIN_TIMEOUT', '10'))
+
+
+# Cache
+# https://docs.djangoproject.com/en/2.2/topics/cache/
+# Use a cache shared by all processes (e.g. memcached), otherwise only the process
+# changing a ban clears the cached state, the others notice it after BAN_CACHE_TIMEOUT.
+
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', ''),
+    }
+}
+
+BAN_CACHE_TIMEOUT = int(os.environ.get('BAN_CACHE_TIMEOUT', '300'))
+
+# With multiple processes enable TOKEN_CACHE_SHARED, so deleted tokens are rejected by all of them at once
+TOKEN_CACHE_SIZE = int(os.environ.get('TOKEN_CACHE_SIZE', '1000'))
+TOKEN_CACHE_TIMEOUT = int(os.environ.get('TOKEN_CACHE_TIMEOUT', '60'))
+TOKEN_CACHE_SHARED = os.environ.get('TOKEN_CACHE_SHARED', 'false').lower() == 'true'
+
 
 # E-Mail
 # https://docs.djangoproject.com/en/1.10/topics/email/
@@ -80,6 +109,12 @@ EMAIL_SUBJECT_PREFIX = '[WildFyre] '
 DEFAULT_FROM_EMAIL = os.environ.get('DEFAULT_FROM_EMAIL', 'noreply@wildfyre.net')
 
 
+# Background workers
+
+BACKGROUND_WORKERS = int(os.environ.get('BACKGROUND_WORKERS', '2'))
+STACK_PREFILL = os.environ.get('STACK_PREFILL', 'false').lower() == 'true'
+
+
 # reCAPTCHA secret key
 # https://www.google.com/recaptcha/admin
 
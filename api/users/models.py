@@ -11,8 +11,6 @@ class ProfileQuerySet(models.QuerySet):
         """
         Gets the profile. If it doesn't exist it is created
         """
-        # Use write databse. It's more up to date.
-        self._for_write = True
         try:
             return super().get(*args, **kwargs)
         except self.model.DoesNotExist as e:
@@ -30,6 +28,7 @@ class ProfileQuerySet(models.QuerySet):
                     return self.create(user=user)
                 except IntegrityError:
                     # Someone trying to create the same profile was faster. It should be there now though.
+                    # The write pins this thread to the primary, where it is up to date.
                     return super().get(*args, **kwargs)
 
 
@@ -1,11 +1,29 @@
+from django.db import models
+
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
 
+from bans.models import Ban, BanState
 from core.validators import FileSizeValidator
 
 from .models import Profile
 
 
+class ProfileListSerializer(serializers.ListSerializer):
+    """
+    Looks up whether the users are banned all at once
+    """
+    def to_representation(self, data):
+        profiles = list(data.all() if isinstance(data, models.Manager) else data)
+
+        users = [profile.user for profile in profiles if not hasattr(profile.user, 'banned')]
+        banned = Ban.active.banned(users)
+        for user in users:
+            user.banned = user.pk in banned
+
+        return super().to_representation(profiles)
+
+
 class ProfileSerializer(serializers.ModelSerializer):
     name = serializers.ReadOnlyField(source='user.username')
     avatar = serializers.ImageField(allow_null=True, max_length=100, required=False, validators=[FileSizeValidator(0.5)])
@@ -15,6 +33,7 @@ class ProfileSerializer(serializers.ModelSerializer):
         model = Profile
         fields = ('user', 'name', 'avatar', 'bio', 'banned')
         read_only_fields = ('user', 'banned')
+        list_serializer_class = ProfileListSerializer
 
     def create(self, validated_data):
         if Profile.objects.filter(user=validated_data.get('user')).count() != 0:
@@ -22,4 +41,7 @@ class ProfileSerializer(serializers.ModelSerializer):
         return super().create(validated_data)
 
     def get_banned(self, obj):
-        return obj.user.ban_set(manager='active').exists()
+        if hasattr(obj.user, 'banned'):
+            # Annotated to the user
+            return obj.user.banned
+        return BanState.get(obj.user).banned
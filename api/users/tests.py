@@ -1,12 +1,16 @@
 import django
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import AnonymousUser
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 
 from rest_framework import status
 from rest_framework.test import APIRequestFactory, APITestCase, force_authenticate
 
+from bans.models import Ban
+
 from .models import *
 from .views import *
 
@@ -115,3 +119,37 @@ class ProfileAutoCreateTest(APITestCase):
 
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertTrue(Profile.objects.all().filter(user=self.user1).exists())
+
+
+class MultipleProfilesTest(APITestCase):
+    def setUp(self):
+        self.users = [
+            get_user_model().objects.create_user(username='user%s' % i, password='secret') for i in range(4)
+        ]
+        Ban.objects.create(user=self.users[2], ban_all=True)
+
+    def test_banned(self):
+        """
+        The banned flag of every profile is correct
+        """
+        response = self.client.get(reverse('users:get-profiles'), {'id': [user.pk for user in self.users]})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual({profile['user']: profile['banned'] for profile in response.data},
+                         {user.pk: user == self.users[2] for user in self.users})
+
+    def test_query_count(self):
+        """
+        Missing profiles are created at once
+        """
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('users:get-profiles'), {'id': [user.pk for user in self.users]})
+
+        self.assertEqual(len(response.data), len(self.users))
+        self.assertEqual(Profile.objects.filter(user__in=self.users).count(), len(self.users))
+        self.assertLessEqual(len(queries), 4)
+
+    def test_too_many(self):
+        response = self.client.get(reverse('users:get-profiles'), {'id': list(range(1, MultipleUserProfilesView.max_ids + 2))})
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
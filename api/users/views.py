@@ -15,6 +15,7 @@ class ProfileView(generics.RetrieveUpdateAPIView):
     queryset = Profile.objects.all()
     serializer_class = serializers.ProfileSerializer
     permission_classes = (permissions.IsAuthenticated,)
+    use_replica = True
 
     def get_object(self):
         user = self.request.user
@@ -30,6 +31,7 @@ class UserProfileView(generics.RetrieveAPIView):
     queryset = Profile.objects.all()
     serializer_class = serializers.ProfileSerializer
     lookup_field = 'user'
+    use_replica = True
 
 
 class MultipleUserProfilesView(generics.ListAPIView):
@@ -38,17 +40,25 @@ class MultipleUserProfilesView(generics.ListAPIView):
     """
     serializer_class = serializers.ProfileSerializer
     pagination_class = None
+    use_replica = True
+    max_ids = 100
 
     def get_queryset(self):
+        ids = self.request.GET.getlist('id')
+        if len(ids) > self.max_ids:
+            raise exceptions.ParseError('At most %s ids are allowed' % self.max_ids)
+
         try:
-            profiles = list()
-            for user in User.objects.filter(pk__in=self.request.GET.getlist('id')).only('profile').select_related('profile'):  # We just need the users profile
-                try:
-                    profiles.append(user.profile)
-                except Profile.DoesNotExist:
-                    # Thre is currently no profile associated with that user.
-                    # Profile.objects.get automatically creates a new profile in such a case.
-                    profiles.append(Profile.objects.get(user=user))
-            return profiles
+            users = list(User.objects.filter(pk__in=ids).select_related('profile'))
         except ValueError:
             raise exceptions.ParseError('id must be an integer')
+
+        missing = {user.pk: user for user in users if not hasattr(user, 'profile')}
+        if missing:
+            # There is currently no profile associated with these users, create them all at once.
+            # Someone else might be faster creating some of them, so load them afterwards.
+            Profile.objects.bulk_create([Profile(user=user) for user in missing.values()], ignore_conflicts=True)
+            for profile in Profile.objects.filter(user__in=list(missing)):
+                profile.user = missing[profile.user_id]
+
+        return [user.profile for user in users]